@@ -10,10 +10,12 @@ from exercises_server_api import ExercisesServerSession
 
 USAGE = '''
 Usage:
-    client.py <server> <port> read (<id> [<seed>])...
+    client.py [--cache-dir=<dir>] <server> <port> read (<id> [<seed>])...
     client.py <server> <port> list
 
 Options:
+    --cache-dir=<dir>  Keep the zips read in this directory, so that they
+                       are only downloaded once.
     read <id> [<seed>]: a list of ids and optional seeds can be given. If no
     seeds are specified, the template zip is returned, else an instance of the
     template is returned.
@@ -66,7 +68,8 @@ if __name__ == "__main__":
     server = arguments['<server>']
     port = arguments['<port>']
     session = ExercisesServerSession('{}:{}'.format(server, port), auth=None,
-                                     verify=False)
+                                     verify=False,
+                                     cache_dir=arguments['--cache-dir'])
     alltemplates = session.list('testing')
     # just list all the template IDs
     if arguments['list']:
@@ -81,19 +84,22 @@ if __name__ == "__main__":
         else:
             all_seeds = [None for i in all_ids]
 
-        for _id, _seed in zip(all_ids, all_seeds):
-
-            # if we're asking for a full id, just ask the server for it
-
+        # resolve short ids from the list of ids on the server
+        long_ids = []
+        for _id in all_ids:
             if len(_id) > 8:
-                template = session.read(_id, 'testing', _seed)
+                long_ids.append(_id)
             else:
-                # if we're asking for a short id, first get the list of ids
-                # from the server then select the correct one
                 template = [t for t in alltemplates if t['id'].startswith(_id)]
                 assert(len(template) == 1)
-                template = template[0]
-                longid = template['id']
-                template = session.read(longid, 'testing', _seed)
+                long_ids.append(template[0]['id'])
+
+        # fetch all the templates in one request
+        templates = session.read_many([
+            {'id': longid, 'version': 'testing', 'random_seed': _seed}
+            for longid, _seed in zip(long_ids, all_seeds)])
 
-            template = write_template(template, _id, _seed)
+        for _id, _seed, template in zip(all_ids, all_seeds, templates):
+            if isinstance(template, Exception):
+                raise template
+            write_template(template, _id, _seed)
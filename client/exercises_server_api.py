@@ -2,11 +2,25 @@
 Exercises server client API. Import this module and use the
 ExercisesServerSession class to connect and make calls to an exercises
 server. The methods of this class implement all available REST calls,
-namely list, read, update, publish, retract.
+namely list, changes, read, read_many, update, update_batch, publish,
+retract, jobs. The read, update and publish calls can also be made
+concurrently over an iterable of exercises.
 '''
 import requests
 import urlparse
 import json
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import threading
+import Queue
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 
 class ExercisesServerException(Exception):
@@ -70,13 +84,116 @@ class UnhandledResponse(ExercisesServerException):
     pass
 
 
+class PutRetry(Retry):
+    '''
+    Retry policy that doesn't retry puts on a 504 Gateway Timeout:
+    the server may still be validating and storing the exercise, and
+    would do it all again.
+    '''
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == 'PUT' and status_code == 504:
+            return False
+        return Retry.is_retry(self, method, status_code, has_retry_after)
+
+
+class ExerciseCache:
+    '''
+    A directory of exercise zips keyed by (id, version, random_seed).
+    Versions are immutable, so entries never go stale; when the total
+    size exceeds max_bytes, the least recently read entries are
+    deleted. Entries are written atomically, so several processes can
+    share a directory.
+    '''
+
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, error:
+                if error.errno != errno.EEXIST:
+                    raise
+        self.size = sum(size for path, size, mtime in self.__entries())
+
+    def __entries(self):
+        '''
+        Internal method to list the (path, size, mtime) of each entry.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.zip'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def path(self, id, version, random_seed=None):
+        key = json.dumps([str(id), str(version), None if random_seed is None else int(random_seed)])
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.zip')
+
+    def get(self, id, version, random_seed=None):
+        '''
+        Return the cached zip data, or None if it isn't cached.
+        '''
+        path = self.path(id, version, random_seed)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # the modification time doubles as the last read time
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, id, version, random_seed, data):
+        '''
+        Add zip data to the cache, evicting old entries if it is full.
+        '''
+        fd, tempPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tempPath, self.path(id, version, random_seed))
+        except Exception:
+            os.remove(tempPath)
+            raise
+        with self.__lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        '''
+        Delete the least recently read entries until the cache fits in
+        max_bytes.
+        '''
+        entries = sorted(self.__entries(), key=lambda entry: entry[2])
+        self.size = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
 class ExercisesServerSession:
     '''
     Class for setting up a session with the exercises server and
     making requests.
     '''
 
-    def __init__(self, host_uri, auth=None, verify=True):
+    def __init__(self, host_uri, auth=None, verify=True, binary_reads=True, binary_uploads=True, etag_cache_size=256,
+                 pool_maxsize=10, retries=3, backoff_factor=0.5,
+                 cache_dir=None, cache_max_bytes=1024**3, head_ttl=5):
         '''
         Create a new exercises server session.
 
@@ -88,12 +205,86 @@ class ExercisesServerSession:
 
         verify - Whether to verify the signature of an HTTPS connect,
             if one is being made. Ignore for non-secure connections.
+
+        binary_reads - Whether to ask the server to send exercise zips
+            as raw binary data rather than base-64 encoded in JSON.
+            Servers that don't support this send JSON anyway.
+
+        binary_uploads - Whether to upload exercise zips to /update as
+            raw binary data rather than base-64 encoded in JSON. Set
+            this to False for servers that only accept JSON.
+
+        etag_cache_size - The number of read and list responses to
+            keep, so that repeating those requests only needs a 304
+            Not Modified reply if nothing changed. 0 to disable.
+
+        pool_maxsize - The number of keep-alive connections to the
+            server to keep open, and the default number of requests
+            the *_concurrently() methods make at a time.
+
+        retries - The number of times to retry a request that failed
+            to connect or got a 502, 503 or 504 response, waiting
+            backoff_factor * 2^n seconds before the nth retry. Only
+            idempotent requests (all but /read_batch) are retried, and
+            puts are not retried on 504, as the server may still be
+            handling them. submit() is only retried if it failed to
+            connect, so that it never queues a job twice.
+
+        cache_dir - A directory in which to keep the exercise zips
+            returned by read(), keyed by id, version and random seed,
+            so that reading them again needs no download. Branch heads
+            are resolved to versions with one /list request and then
+            followed with /changes requests. Default: no cache.
+
+        cache_max_bytes - The size to which the cache directory is
+            limited, by deleting the least recently read zips.
+
+        head_ttl - The number of seconds for which read() trusts the
+            branch heads it knows before checking /changes again.
         '''
         self.host_uri = host_uri
-        self.request_params = {
-            'auth': auth,
-            'verify': verify,
-        }
+        self.binary_reads = binary_reads
+        self.binary_uploads = binary_uploads
+        self.etag_cache_size = etag_cache_size
+        self.pool_maxsize = pool_maxsize
+        self.__etag_cache = OrderedDict()
+        self.__etag_lock = threading.Lock()
+
+        # One session for all requests, so that connections (and TLS
+        # sessions) are reused and cookies are kept, the latter so
+        # that reads after writes are served by the primary database.
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.verify = verify
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            max_retries=PutRetry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[502, 503, 504],
+                raise_on_status=False))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        submitAdapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=retries,
+                read=False,
+                backoff_factor=backoff_factor))
+        self.session.mount(urlparse.urljoin(self.host_uri, '/update?async=1'), submitAdapter)
+
+        self.cache = ExerciseCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+        self.head_ttl = head_ttl
+        self.__heads = {}
+        self.__heads_lock = threading.Lock()
+
+    def close(self):
+        '''
+        Close the session's connections to the server.
+        '''
+        self.session.close()
 
     def __handle_unexpected_status_codes(self, response, known_codes=[200]):
         '''
@@ -107,6 +298,35 @@ class ExercisesServerSession:
                 message = None
             raise UnhandledResponse(response.status_code, message)
 
+    def __conditional_get(self, path, json_data, headers={}):
+        '''
+        Internal method to make a GET request, sending the ETag of a
+        previous response to the same request if one is cached. If
+        the server replies 304 Not Modified, the cached response is
+        returned instead.
+        '''
+        data = json.dumps(json_data, sort_keys=True)
+        key = (path, data, tuple(sorted(headers.items())))
+        with self.__etag_lock:
+            cached = self.__etag_cache.pop(key, None)
+        headers = dict(headers)
+        if cached is not None:
+            headers['If-None-Match'] = cached.headers['ETag']
+
+        response = self.session.get(
+            urlparse.urljoin(self.host_uri, path),
+            data=data,
+            headers=headers)
+        if response.status_code == 304 and cached is not None:
+            response = cached
+
+        if self.etag_cache_size and response.status_code == 200 and 'ETag' in response.headers:
+            with self.__etag_lock:
+                self.__etag_cache[key] = response
+                while len(self.__etag_cache) > self.etag_cache_size:
+                    self.__etag_cache.popitem(last=False)
+        return response
+
     def read(self, id, version=None, random_seed=None, make_derivative=None):
         '''
         Read an exercise zip from the server.
@@ -125,10 +345,33 @@ class ExercisesServerSession:
         make_derivative - Whether to inject the derived-from headers
             into the exercise XML. Default: False. NOT YET IMPLEMENTED.
 
+        If the session has a cache_dir, the zip is read from there if
+        it was read before, resolving a branch to its head version
+        first.
+
         Returns a binary string with the exercise zip.
 
         Raises NotFound if the specified exercise was not found.
         '''
+        if self.cache is None or make_derivative:
+            return self.__read(id, version, random_seed, make_derivative)
+
+        if version is None or version in ['published', 'testing']:
+            resolved = self.head(id, version or 'published')
+            if resolved is None:
+                # not on the branch as far as we know; ask the server
+                return self.__read(id, version, random_seed, make_derivative)
+            version = resolved
+        data = self.cache.get(id, version, random_seed)
+        if data is None:
+            data = self.__read(id, version, random_seed, make_derivative)
+            self.cache.put(id, version, random_seed, data)
+        return data
+
+    def __read(self, id, version, random_seed, make_derivative):
+        '''
+        Internal method to read an exercise zip from the server.
+        '''
         json_data = {'id': str(id)}
         if version is not None:
             json_data['version'] = str(version)
@@ -136,44 +379,269 @@ class ExercisesServerSession:
             json_data['random_seed'] = int(random_seed)
         if make_derivative is not None:
             json_data['make_derivative'] = bool(make_derivative)
-        response = requests.get(
-            urlparse.urljoin(self.host_uri, '/read'),
-            data=json.dumps(json_data),
-            **self.request_params)
+        headers = {}
+        if self.binary_reads:
+            headers['Accept'] = 'application/zip, application/json;q=0.5'
+        response = self.__conditional_get('/read', json_data, headers)
         self.__handle_unexpected_status_codes(response, [200, 404])
         if response.status_code == 404:
             raise NotFound(response.status_code, "Exercise not found")
+        if response.headers.get('Content-Type') == 'application/zip':
+            return response.content
         from base64 import b64decode
         return b64decode(json.loads(response.content)['exercise'])
 
-    def insert_or_update(self, id, version, zipData):
+    def head(self, id, branch=None):
         '''
-        Put an exercise to the server (create or replace existing).
+        Return the version of an exercise at the head of a branch, or
+        None if it is not on the branch. The heads of the branch are
+        listed once and then kept up to date from the change feed, at
+        most every head_ttl seconds.
 
-        id - The id of the exercise to put.
+        branch - One of 'published' or 'testing'. Default: 'published'.
+        '''
+        return self.__branch_heads(branch or 'published').get(str(id))
 
-        version - The version number of the exercise to put.
+    def __branch_heads(self, branch):
+        '''
+        Internal method to return a dict of the versions of the
+        exercises on a branch by id.
+        '''
+        with self.__heads_lock:
+            heads = self.__heads.get(branch)
+            if heads is not None and time.time() - heads['checked'] < self.head_ttl:
+                return heads['versions']
+
+            if heads is None:
+                response = self.session.get(
+                    urlparse.urljoin(self.host_uri, '/list'),
+                    data=json.dumps({'branch': branch}))
+                self.__handle_unexpected_status_codes(response)
+                body = json.loads(response.content)
+                heads = {
+                    'versions': dict((entry['id'], entry['version']) for entry in body['exercises']),
+                    'cursor': body['cursor'],
+                }
+                self.__heads[branch] = heads
+            else:
+                for change in self.changes(branch, since=heads['cursor']):
+                    if change['change'] == 'retracted':
+                        heads['versions'].pop(change['id'], None)
+                    else:
+                        heads['versions'][change['id']] = change['version']
+                    heads['cursor'] = change['seq']
+            heads['checked'] = time.time()
+            return heads['versions']
+
+    def read_many(self, items):
+        '''
+        Read many exercise zips from the server in a single request.
 
-        zipData - The binary string of exercise zip data.
+        items - A list of dicts, each with an 'id' key and optional
+            'version' and 'random_seed' keys, with the same meaning
+            as the arguments to read().
 
-        If an exercise with the given id and version already exists,
-        it will be replaced; otherwise it will be created.
+        Returns a list with one entry per item, in the same order. An
+        entry is either a binary string with the exercise zip, or an
+        ExercisesServerException (NotFound if the exercise was not
+        found) if that item could not be read.
+        '''
+        if self.cache is None:
+            return self.__read_many(items)
+
+        # only request the exercises that are not in the cache
+        results = [None] * len(items)
+        missing = []
+        for index, item in enumerate(items):
+            version = item.get('version')
+            if version is None or version in ['published', 'testing']:
+                version = self.head(item['id'], version or 'published')
+            if version is not None:
+                data = self.cache.get(item['id'], version, item.get('random_seed'))
+                if data is not None:
+                    results[index] = data
+                    continue
+                item = dict(item, version=version)
+            missing.append((index, item, version))
+
+        if missing:
+            fetched = self.__read_many([entry for _, entry, _ in missing])
+            for (index, entry, version), result in zip(missing, fetched):
+                if version is not None and not isinstance(result, Exception):
+                    self.cache.put(entry['id'], version, entry.get('random_seed'), result)
+                results[index] = result
+        return results
+
+    def __read_many(self, items):
+        '''
+        Internal method to read many exercise zips from the server.
+        '''
+        exercises = []
+        for item in items:
+            json_data = {'id': str(item['id'])}
+            if item.get('version') is not None:
+                json_data['version'] = str(item['version'])
+            if item.get('random_seed') is not None:
+                json_data['random_seed'] = int(item['random_seed'])
+            exercises.append(json_data)
+        response = self.session.post(
+            urlparse.urljoin(self.host_uri, '/read_batch'),
+            data=json.dumps({'exercises': exercises}))
+        self.__handle_unexpected_status_codes(response)
 
-        Raises ValidationError if the exercise failed to validate.
+        from base64 import b64decode
+        results = []
+        for result in json.loads(response.content)['exercises']:
+            if 'error' in result:
+                if result['error']['status'] == 404:
+                    results.append(NotFound(404, result['error']['message']))
+                else:
+                    results.append(UnhandledResponse(result['error']['status'], result['error']['message']))
+            else:
+                results.append(b64decode(result['exercise']))
+        return results
+
+    def __put_update(self, path, id, version, zipData):
         '''
+        Internal method to upload an exercise zip to +path+ (/update,
+        with any query string), either raw or base-64 encoded in JSON.
+        '''
+        if self.binary_uploads:
+            return self.session.put(
+                urlparse.urljoin(self.host_uri, path),
+                params={'id': str(id), 'version': str(version)},
+                data=zipData,
+                headers={'Content-Type': 'application/zip'})
+
         from base64 import b64encode
-        response = requests.put(
-            urlparse.urljoin(self.host_uri, '/update'),
+        return self.session.put(
+            urlparse.urljoin(self.host_uri, path),
             data=json.dumps({
                 'id': str(id),
                 'version': str(version),
-                'data_base64': b64encode(zipData)}),
-            **self.request_params)
+                'data_base64': b64encode(zipData)}))
+
+    def insert_or_update(self, id, version, zipData):
+        '''
+        Put an exercise to the server.
+
+        id - The id of the exercise to put.
+
+        version - The version number of the exercise to put.
+
+        zipData - The binary string of exercise zip data.
+
+        Versions are immutable: if an exercise with the given id and
+        version already exists, it is only put again if it has the
+        same zip members.
+
+        Returns whether validation was skipped because the server had
+        already validated identical data.
+
+        Raises ValidationError if the exercise failed to validate, and
+        UnhandledResponse with status_code 409 if the version already
+        exists with different contents.
+        '''
+        response = self.__put_update('/update', id, version, zipData)
         self.__handle_unexpected_status_codes(response, [200, 400])
         if response.status_code == 400:
             body = response.json()
             raise ValidationError(response.status_code, body['error']['message'], body['error']['validation_result'])
-        assert json.loads(response.content)['result'] == 'success'
+        body = json.loads(response.content)
+        assert body['result'] == 'success'
+        return body.get('validation_cached', False)
+
+    def insert_or_update_many(self, entries):
+        '''
+        Put many exercises to the server in one request. The server
+        validates them concurrently and stores all that pass in one
+        transaction.
+
+        entries - A list of (id, version, zipData) tuples, with the
+            same meaning as the arguments to insert_or_update().
+
+        Returns a list with one entry per exercise, in the same
+        order. An entry is either a bool saying whether validation was
+        skipped because the server had already validated identical
+        data, or a ValidationError (or other ExercisesServerException)
+        if that exercise was not stored.
+        '''
+        fields = []
+        files = []
+        for id, version, zipData in entries:
+            fields += [('id', str(id)), ('version', str(version))]
+            files.append(('data', ('%s-%s.zip' % (id, version), zipData, 'application/zip')))
+        response = self.session.put(
+            urlparse.urljoin(self.host_uri, '/update_batch'),
+            data=fields,
+            files=files)
+        self.__handle_unexpected_status_codes(response)
+
+        results = []
+        for result in json.loads(response.content)['exercises']:
+            if 'error' not in result:
+                results.append(result['validation_cached'])
+            elif 'validation_result' in result['error']:
+                results.append(ValidationError(result['error']['status'], result['error']['message'], result['error']['validation_result']))
+            else:
+                results.append(UnhandledResponse(result['error']['status'], result['error']['message']))
+        return results
+
+    def submit(self, id, version, zipData):
+        '''
+        Queue an exercise to be validated and put to the server in the
+        background, like insert_or_update() but without waiting for
+        validation to finish.
+
+        Returns the id of the job, to pass to wait().
+        '''
+        # the query string is part of the path, so that the request
+        # goes through the submit adapter, which doesn't retry once the
+        # request may have been sent
+        response = self.__put_update('/update?async=1', id, version, zipData)
+        self.__handle_unexpected_status_codes(response, [202])
+        return json.loads(response.content)['job_id']
+
+    def job(self, jobId):
+        '''
+        Return the status of the job with the given id as a dict. See
+        the server's GET /jobs/<job_id> for the keys.
+        '''
+        response = self.session.get(
+            urlparse.urljoin(self.host_uri, '/jobs/%s' % jobId))
+        self.__handle_unexpected_status_codes(response, [200, 404])
+        if response.status_code == 404:
+            raise NotFound(response.status_code, response.json()['error']['message'])
+        return json.loads(response.content)['job']
+
+    def wait(self, jobId, poll_interval=1, timeout=None):
+        '''
+        Wait for a job queued by submit() to finish, polling every
+        +poll_interval+ seconds for at most +timeout+ seconds (None to
+        wait indefinitely).
+
+        Returns whether validation was skipped because the server had
+        already validated identical data, like insert_or_update().
+
+        Raises ValidationError if the exercise failed to validate and
+        UnhandledResponse if the job failed for another reason or did
+        not finish in time.
+        '''
+        start = time.time()
+        while True:
+            job = self.job(jobId)
+            if job['status'] in ('succeeded', 'failed'):
+                break
+            if timeout is not None and time.time() - start > timeout:
+                raise UnhandledResponse(None, "Job %s did not finish within %s seconds" % (jobId, timeout))
+            time.sleep(poll_interval)
+
+        result = job['result']
+        if job['status'] == 'succeeded':
+            return result['validation_cached']
+        if 'validation_result' in result:
+            raise ValidationError(None, "Exercise failed to validate", result['validation_result'])
+        raise UnhandledResponse(None, "Job %s failed: %s" % (jobId, result.get('exception')))
 
     def publish(self, id, version=None, branch=None):
         '''
@@ -196,10 +664,9 @@ class ExercisesServerSession:
             json_data['version'] = str(version)
         if branch is not None:
             json_data['branch'] = str(branch)
-        response = requests.put(
+        response = self.session.put(
             urlparse.urljoin(self.host_uri, '/publish'),
-            data=json.dumps(json_data),
-            **self.request_params)
+            data=json.dumps(json_data))
         self.__handle_unexpected_status_codes(response)
         assert json.loads(response.content)['result'] == 'success'
 
@@ -217,10 +684,9 @@ class ExercisesServerSession:
         json_data = {'id': str(id)}
         if branch is not None:
             json_data['branch'] = str(branch)
-        response = requests.put(
+        response = self.session.put(
             urlparse.urljoin(self.host_uri, '/retract'),
-            data=json.dumps(json_data),
-            **self.request_params)
+            data=json.dumps(json_data))
         self.__handle_unexpected_status_codes(response)
         assert json.loads(response.content)['result'] == 'success'
 
@@ -238,16 +704,154 @@ class ExercisesServerSession:
         json_data = {}
         if branch is not None:
             json_data['branch'] = branch
-        response = requests.get(
-            urlparse.urljoin(self.host_uri, '/list'),
-            data=json.dumps(json_data),
-            **self.request_params)
+        response = self.__conditional_get('/list', json_data)
         self.__handle_unexpected_status_codes(response)
         return json.loads(response.content)['exercises']
 
+    def changes(self, branch=None, since=0, limit=None):
+        '''
+        Iterate over the changes to the exercise heads on a branch,
+        oldest first, following the change feed until there are no
+        more changes.
+
+        branch - The branch to follow, one of 'published' or
+            'testing'. Default: 'published'.
+
+        since - Only return changes after this cursor. Use the 'seq'
+            of the last change seen, or 0 to start from the beginning.
+
+        limit - The number of changes to fetch per request. Default:
+            the server default.
+
+        Yields dicts with 'seq', 'id', 'version' and 'change' keys,
+        where 'change' is one of 'added', 'moved' or 'retracted' (with
+        a 'version' of None).
+        '''
+        while True:
+            params = {'since': since}
+            if branch is not None:
+                params['branch'] = branch
+            if limit is not None:
+                params['limit'] = limit
+            response = self.session.get(
+                urlparse.urljoin(self.host_uri, '/changes'),
+                params=params)
+            self.__handle_unexpected_status_codes(response)
+            body = json.loads(response.content)
+            if not body['changes']:
+                return
+            for change in body['changes']:
+                yield change
+            since = body['cursor']
+
+    def __concurrently(self, method, items, max_workers):
+        '''
+        Internal method to call method(item) for each of +items+ in a
+        thread pool, with at most +max_workers+ calls in flight at a
+        time, taking items from the iterable only as calls finish.
+
+        Yields (item, result) pairs in the order in which the calls
+        finish, where result is the exception if the call raised one.
+        '''
+        if max_workers is None:
+            max_workers = self.pool_maxsize
+        results = Queue.Queue()
+
+        def call(item):
+            try:
+                result = method(item)
+            except Exception, error:
+                result = error
+            results.put((item, result))
+
+        threads = ThreadPool(max_workers)
+        try:
+            inFlight = 0
+            for item in items:
+                if inFlight == max_workers:
+                    yield results.get()
+                    inFlight -= 1
+                threads.apply_async(call, (item,))
+                inFlight += 1
+            while inFlight > 0:
+                yield results.get()
+                inFlight -= 1
+        finally:
+            threads.close()
+
+    def read_concurrently(self, items, max_workers=None):
+        '''
+        Read many exercise zips from the server, making several read
+        requests at a time over the session's pooled connections.
+
+        items - An iterable of dicts, each with an 'id' key and
+            optional 'version' and 'random_seed' keys, with the same
+            meaning as the arguments to read().
+
+        max_workers - The number of requests in flight at a time.
+            Default: the session's pool_maxsize.
+
+        Yields (item, result) pairs as the reads complete, in no
+        particular order. A result is either a binary string with the
+        exercise zip, or the exception raised by read() (NotFound if
+        the exercise was not found).
+        '''
+        return self.__concurrently(
+            lambda item: self.read(item['id'], version=item.get('version'), random_seed=item.get('random_seed')),
+            items, max_workers)
+
+    def insert_or_update_concurrently(self, entries, max_workers=None):
+        '''
+        Put many exercises to the server, making several update
+        requests at a time over the session's pooled connections.
+
+        entries - An iterable of (id, version, zipData) tuples, with
+            the same meaning as the arguments to insert_or_update().
+
+        max_workers - The number of requests in flight at a time.
+            Default: the session's pool_maxsize.
+
+        Yields (entry, result) pairs as the updates complete, in no
+        particular order. A result is either a bool saying whether
+        validation was skipped because the server had already
+        validated identical data, or the exception raised by
+        insert_or_update() (ValidationError if the exercise failed to
+        validate).
+        '''
+        return self.__concurrently(
+            lambda entry: self.insert_or_update(*entry),
+            entries, max_workers)
+
+    def publish_concurrently(self, items, max_workers=None):
+        '''
+        Publish many exercises, making several publish requests at a
+        time over the session's pooled connections.
+
+        items - An iterable of dicts, each with an 'id' key and
+            optional 'version' and 'branch' keys, with the same meaning
+            as the arguments to publish().
+
+        max_workers - The number of requests in flight at a time.
+            Default: the session's pool_maxsize.
+
+        Yields (item, result) pairs as the requests complete, in no
+        particular order. A result is None on success, or the
+        exception raised by publish().
+        '''
+        return self.__concurrently(
+            lambda item: self.publish(item['id'], version=item.get('version'), branch=item.get('branch')),
+            items, max_workers)
+
 
 if __name__ == '__main__':
 
+    def zip_contents(zipData):
+        # The server rebuilds zips from their members, with fixed
+        # timestamps and without directory entries, so compare those
+        import zipfile, StringIO
+        zipArchive = zipfile.ZipFile(StringIO.StringIO(zipData))
+        return dict((name, zipArchive.read(name)) for name in zipArchive.namelist() if not name.endswith('/'))
+
     def template_id_to_uuid(iTemplateId):
         from uuid import uuid5, NAMESPACE_X500
         return uuid5(NAMESPACE_X500, '/monassis/template/' + str(iTemplateId))
@@ -278,7 +882,7 @@ if __name__ == '__main__':
     print 'Reading back exercise'
     for version in ['testing', exerciseVersion]:
         print 'Read', version
-        assert session.read(exerciseId, version=version) == exerciseData
+        assert zip_contents(session.read(exerciseId, version=version)) == zip_contents(exerciseData)
 
     try:
         session.read(exerciseId, random_seed=123)
@@ -290,7 +894,7 @@ if __name__ == '__main__':
     # publish
     print 'Publishing'
     session.publish(exerciseId)
-    assert session.read(exerciseId, version='published') == exerciseData
+    assert zip_contents(session.read(exerciseId, version='published')) == zip_contents(exerciseData)
     session.read(exerciseId, random_seed=123)
 
     print 'Listing branches'
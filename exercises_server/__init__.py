@@ -14,10 +14,35 @@ def main(global_config, **settings):
 
     setup_database(settings)
 
+    from exercises_server.metrics import setup_metrics
+    setup_metrics(settings)
+
+    from exercises_server.cache import setup_instance_cache
+    setup_instance_cache(settings)
+
+    from exercises_server.workers import setup_worker_pool
+    setup_worker_pool(settings)
+
+    from exercises_server.validation import setup_validation
+    setup_validation(settings)
+
+    from exercises_server.warmup import setup_warmup
+    setup_warmup(settings)
+
     from pyramid.config import Configurator
     config = Configurator(settings=settings)
 
     setup_routes(config)
+    config.add_tween('exercises_server.metrics.metrics_tween_factory')
+
+    from exercises_server.jobs import setup_jobs
+    setup_jobs(settings, config)
+
+    from exercises_server.slowlog import setup_slow_log
+    setup_slow_log(settings, config)
+
+    from exercises_server.profiling import setup_profiling
+    setup_profiling(settings, config)
 
     config.scan()
     return config.make_wsgi_app()
@@ -25,20 +50,33 @@ def main(global_config, **settings):
 
 def setup_routes(config):
     config.add_route('read',    '/read',    request_method='GET')
+    config.add_route('read_batch', '/read_batch', request_method='POST')
     config.add_route('update',  '/update',  request_method='PUT')
+    config.add_route('update_batch', '/update_batch', request_method='PUT')
     config.add_route('publish', '/publish', request_method='PUT')
     config.add_route('retract', '/retract', request_method='PUT')
     config.add_route('list',    '/list',    request_method='GET')
+    config.add_route('changes', '/changes', request_method='GET')
+    config.add_route('job',     '/jobs/{job_id:\d+}', request_method='GET')
+    config.add_route('metrics', '/metrics', request_method='GET')
+    config.add_route('profiles', '/admin/profiles', request_method='GET')
+    config.add_route('profile', '/admin/profiles/{request_id:[0-9a-f-]+}', request_method='GET')
+    config.add_route('pool',    '/admin/pool', request_method='GET')
+    config.add_route('health',  '/health', request_method='GET')
 
 
 def setup_database(settings):
-    from sqlalchemy import engine_from_config
-    from exercises_server.models import DBSession, Base
+    from exercises_server.dbpool import make_engine
+    from exercises_server.models import DBSession, StreamSession, Base
 
-    engine = engine_from_config(settings, 'sqlalchemy.')
+    engine = make_engine(settings, 'sqlalchemy.')
     DBSession.configure(bind=engine)
+    StreamSession.configure(bind=engine)
     Base.metadata.bind = engine
 
+    from exercises_server.replicas import setup_replicas
+    setup_replicas(settings)
+
 
 def setup_logging():
     """
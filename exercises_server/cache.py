@@ -0,0 +1,120 @@
+import threading
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class InstanceCache(object):
+    """
+    A bounded, thread-safe LRU cache of binary values (exercise and
+    generated instance zips).
+
+    Entries are evicted least-recently-used first whenever the cache
+    holds more than +max_items+ entries or more than +max_bytes+ bytes
+    of values. A limit of 0 disables the cache entirely.
+
+    Keys must identify immutable content, e.g. (id, version, seed)
+    where the version has already been resolved from a branch name.
+    """
+
+    def __init__(self, max_items=0, max_bytes=0):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    @property
+    def enabled(self):
+        return self.max_items > 0 and self.max_bytes > 0
+
+
+    def get(self, key):
+        """
+        Return the value stored under +key+, or None if there is none.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+
+    def put(self, key, value):
+        """
+        Store +value+ under +key+, evicting old entries as necessary.
+        Values larger than the whole cache are not stored.
+        """
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+
+            while len(self._entries) > self.max_items or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def stats(self):
+        return {
+            'items': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# Generated template instances, keyed by (id, version, seed)
+instance_cache = InstanceCache()
+
+# Exercise zips rebuilt from their stored members, keyed by manifest
+zip_cache = InstanceCache()
+
+
+def cache_from_settings(settings, prefix, max_items, max_bytes):
+    """
+    Return a new cache configured from the <prefix>.max_items and
+    <prefix>.max_bytes settings, with the given defaults.
+    """
+    cache = InstanceCache(
+        max_items=int(settings.get(prefix + '.max_items', max_items)),
+        max_bytes=int(settings.get(prefix + '.max_bytes', max_bytes)))
+    log.info("%s: max_items=%d, max_bytes=%d" % (prefix, cache.max_items, cache.max_bytes))
+    return cache
+
+
+def setup_instance_cache(settings):
+    """
+    (Re)configure the module-level caches from the instance_cache.*
+    and zip_cache.* settings.
+    """
+    global instance_cache, zip_cache
+    instance_cache = cache_from_settings(settings, 'instance_cache', 1000, 64 * 1024 * 1024)
+    zip_cache = cache_from_settings(settings, 'zip_cache', 1000, 64 * 1024 * 1024)
+    return instance_cache
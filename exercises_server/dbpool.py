@@ -0,0 +1,112 @@
+'''
+Database engine creation and connection pool statistics.
+'''
+import os
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import engine_from_config, event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    A QueuePool that also records how long checkouts wait for a
+    connection (including connecting, if a new one is opened) and how
+    many time out.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._statsLock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._statsLock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.time() - start
+            with self._statsLock:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+
+    def stats(self):
+        with self._statsLock:
+            return {
+                'size': self.size(),
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+                'wait_mean': self.wait_total / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+def make_engine(settings, prefix='sqlalchemy.'):
+    '''
+    Create an engine from the <prefix>* settings, like
+    engine_from_config, using a TimedQueuePool for server databases.
+    '''
+    options = {}
+    if prefix + 'pool_pre_ping' in settings:
+        # not converted from a string by engine_from_config
+        options['pool_pre_ping'] = asbool(settings[prefix + 'pool_pre_ping'])
+    if not make_url(settings[prefix + 'url']).drivername.startswith('sqlite'):
+        options['poolclass'] = TimedQueuePool
+    settings = dict((key, value) for key, value in settings.iteritems() if key != prefix + 'pool_pre_ping')
+    engine = engine_from_config(settings, prefix, **options)
+    event.listen(engine, 'connect', record_pid)
+    event.listen(engine, 'checkout', check_pid)
+    return engine
+
+
+def record_pid(dbapiConnection, connectionRecord):
+    connectionRecord.info['pid'] = os.getpid()
+
+
+def check_pid(dbapiConnection, connectionRecord, connectionProxy):
+    '''
+    Refuse connections opened by another process, i.e. inherited
+    across a fork, so that the pool replaces them instead of two
+    processes talking over the same socket.
+    '''
+    pid = os.getpid()
+    if connectionRecord.info.get('pid') != pid:
+        # drop the connection without closing it, which would end the
+        # other process's session
+        connectionRecord.connection = connectionProxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s" % (connectionRecord.info.get('pid'), pid))
+
+
+def pool_stats(engine):
+    '''
+    Return the connection pool statistics of +engine+, as far as its
+    pool class provides them.
+    '''
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        stats = pool.stats()
+    else:
+        stats = {}
+    stats['class'] = type(pool).__name__
+    return stats
@@ -1,6 +1,6 @@
 import json
 
-from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPBadRequest, HTTPConflict, HTTPRequestEntityTooLarge, HTTPServiceUnavailable, HTTPGatewayTimeout
 from pyramid.threadlocal import get_current_request
 
 
@@ -36,6 +36,21 @@ class ExercisesError(object):
             }}
 
 
+def item_error(status, code, message, **kwargs):
+    """
+    Return an error description in the same shape as ExercisesError
+    bodies, for reporting per-item errors in batch responses. Extra
+    keyword arguments are added to the description.
+    """
+    error = {
+        'status': status,
+        'code': code,
+        'message': message,
+    }
+    error.update(kwargs)
+    return error
+
+
 class ExerciseInvalid(ExercisesError, HTTPBadRequest):
     def __init__(self, *args, **kwargs):
         validation_result = kwargs.pop('validation_result', None)
@@ -48,3 +63,19 @@ class ExerciseInvalid(ExercisesError, HTTPBadRequest):
 
 class BadRequest(ExercisesError, HTTPBadRequest):
     pass
+
+
+class ExerciseConflict(ExercisesError, HTTPConflict):
+    pass
+
+
+class RequestTooLarge(ExercisesError, HTTPRequestEntityTooLarge):
+    pass
+
+
+class ServerBusy(ExercisesError, HTTPServiceUnavailable):
+    pass
+
+
+class TaskTimeout(ExercisesError, HTTPGatewayTimeout):
+    pass
@@ -0,0 +1,91 @@
+'''
+Generation of exercise instances from templates.
+
+Everything in here works on plain zip byte strings so that it does
+not depend on a database session or the current request.
+'''
+import StringIO
+import zipfile
+
+from exercises_server.metrics import timer
+from exercises_server.zips import build_instance_zip
+
+
+class NotATemplate(ValueError):
+    '''
+    Raised when an instance is requested for a static exercise.
+    '''
+    pass
+
+
+def is_template(data):
+    '''
+    Return whether the exercise zip +data+ is a template, i.e. whether
+    its main.xml has a <logic> element.
+    '''
+    return is_template_xml(zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml'))
+
+
+def is_template_xml(mainXml):
+    '''
+    Return whether the exercise with main.xml contents +mainXml+ is a
+    template.
+    '''
+    from lxml import etree
+
+    templateDom = etree.fromstring(
+        mainXml,
+        parser=etree.XMLParser(remove_comments=True),
+    )
+    return templateDom.find('logic') is not None
+
+
+def generate_instance_zip(data, random_seed, template=None):
+    '''
+    Generate the instance of the template zip +data+ for the given
+    +random_seed+ and return it as zip data. Pass +template+ if
+    whether +data+ is a template is already known, to save parsing
+    its main.xml to find out.
+
+    Raises NotATemplate if +data+ is a static exercise.
+    '''
+    if template is None:
+        with timer('zip_parse'):
+            template = is_template(data)
+    if not template:
+        raise NotATemplate("Static exercise cannot have a random seed")
+
+    # Generate instance from template
+    from monassis.qnxmlservice import question_from_zip
+    with timer('question_from_zip'):
+        question = question_from_zip(data, iRandomSeed=random_seed)
+
+    # Zip instance up again, copying unchanged members from the template
+    with timer('rezip'):
+        return build_instance_zip(data, question.as_xml(), question.files)
+
+
+def validate_exercise(data):
+    '''
+    Validate the exercise zip +data+ and return the validation result
+    dict, with the exception (if any) converted to its repr so that
+    the result can be serialised.
+    '''
+    from monassis.qnxmlservice import validate_question_zip
+    with timer('validation'):
+        result = validate_question_zip(data)
+    if result.get('exception') is not None:
+        result['exception'] = repr(result['exception'])
+    return result
+
+
+def validator_version():
+    '''
+    Return the version of the installed validator library, or None if
+    it can't be determined.
+    '''
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution('monassis').version
+    except pkg_resources.DistributionNotFound:
+        return None
@@ -0,0 +1,174 @@
+'''
+Background jobs, queued in the jobs table and run by a thread in each
+server process, so that no external message broker is needed. The
+thread is started by the first request a process handles, so that
+with a forking server such as gunicorn it runs in each worker rather
+than in the master process that loaded the application.
+'''
+import os
+import threading
+import time
+from datetime import timedelta
+
+import transaction
+from pyramid.events import NewRequest
+
+from exercises_server import validation, warmup, workers
+from exercises_server.models import DBSession, Job, Exercise, CurrentVersion, VersionConflict
+from exercises_server.utils import now_utc
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def run_validate_job(job):
+    '''
+    Validate the uploaded exercise and, if it passes, store it and
+    move the testing head, just like a synchronous /update.
+    '''
+    result, cached = validation.validate(job.data)
+    if not result['validated']:
+        return 'failed', {'validated': False, 'validation_result': result, 'validation_cached': cached}
+
+    try:
+        exercise = Exercise.store(job.exercise_id, job.version, job.data)
+    except VersionConflict, error:
+        return 'failed', {'validated': True, 'validation_cached': cached, 'exception': str(error)}
+    log.info("Put exercise: %s" % exercise)
+    currentVersion = CurrentVersion.set_head('testing', job.exercise_id, job.version)
+    log.info("Updated branch head: %s" % currentVersion)
+    return 'succeeded', {'validated': True, 'validation_cached': cached}
+
+
+def run_warmup_job(job):
+    '''
+    Generate and store the configured seeds of a published exercise.
+    '''
+    exercise = Exercise.get_by_id(job.exercise_id, job.version)
+    if exercise is None:
+        return 'failed', {'exception': "Exercise %s with version %s not found" % (job.exercise_id, job.version)}
+    return 'succeeded', {'instances': warmup.warm_exercise(exercise)}
+
+
+# Job handlers by kind. A handler takes the job and returns a (status,
+# result) pair, where status is 'succeeded' or 'failed' and result is a
+# JSON-compatible description of the outcome.
+HANDLERS = {
+    'validate': run_validate_job,
+    'warmup': run_warmup_job,
+}
+
+
+stale_after = timedelta(minutes=10)
+
+# Seconds a job waits for each worker pool task, None for no limit
+timeout = 300
+
+
+def run_next_job():
+    '''
+    Claim and run the next queued job. Returns whether there was one.
+    '''
+    with transaction.manager:
+        jobId = Job.claim_next(stale_before=now_utc() - stale_after)
+    if jobId is None:
+        return False
+
+    try:
+        # jobs wait for room in the worker pool rather than failing
+        # with QueueFull, and have their own task timeout
+        with transaction.manager, workers.background(timeout):
+            job = Job.get_by_id(jobId)
+            log.info("Running job: %s" % job)
+            status, result = HANDLERS[job.kind](job)
+            job.finish(status, result)
+            log.info("Finished job: %s" % job)
+    except Exception, error:
+        log.exception("Job %s failed" % jobId)
+        with transaction.manager:
+            Job.get_by_id(jobId).finish('failed', {'exception': repr(error)})
+    finally:
+        DBSession.remove()
+    return True
+
+
+def run_pending_jobs():
+    '''
+    Run queued jobs until there are none left. Returns how many ran.
+    '''
+    count = 0
+    while run_next_job():
+        count += 1
+    return count
+
+
+def evict_instances():
+    with transaction.manager:
+        warmup.evict_instances()
+    DBSession.remove()
+
+
+class JobRunner(threading.Thread):
+    '''
+    A daemon thread that polls for and runs queued jobs, and evicts
+    stored instances every +evict_interval+ seconds.
+    '''
+
+    def __init__(self, poll_interval, evict_interval):
+        super(JobRunner, self).__init__(name='JobRunner')
+        self.daemon = True
+        self.poll_interval = poll_interval
+        self.evict_interval = evict_interval
+
+
+    def run(self):
+        lastEvicted = 0
+        while True:
+            try:
+                run_pending_jobs()
+                if time.time() - lastEvicted >= self.evict_interval:
+                    lastEvicted = time.time()
+                    evict_instances()
+            except Exception:
+                log.exception("Error running jobs")
+            time.sleep(self.poll_interval)
+
+
+runner = None
+_runnerArgs = None
+_runnerPid = None
+_runnerLock = threading.Lock()
+
+
+def start_runner(event=None):
+    '''
+    Start a job runner thread in this process if jobs.runner is
+    enabled and none is running yet. Subscribed to NewRequest.
+    '''
+    global runner, _runnerPid
+    if _runnerArgs is None or _runnerPid == os.getpid():
+        return
+    with _runnerLock:
+        if _runnerPid != os.getpid():
+            runner = JobRunner(*_runnerArgs)
+            runner.start()
+            _runnerPid = os.getpid()
+            log.info("Started job runner in process %d" % _runnerPid)
+
+
+def setup_jobs(settings, config):
+    '''
+    Start a job runner thread in each process, on its first request,
+    if jobs.runner is enabled. It also evicts stored instances every
+    instances.evict_interval seconds.
+    '''
+    global stale_after, timeout, _runnerArgs
+    stale_after = timedelta(seconds=int(settings.get('jobs.stale_after', 600)))
+    timeout = settings.get('jobs.timeout', 300)
+    timeout = float(timeout) if timeout else None
+    _runnerArgs = None
+    if settings.get('jobs.runner', 'false').lower() in ('true', '1', 'yes', 'on'):
+        _runnerArgs = (
+            float(settings.get('jobs.poll_interval', 1)),
+            float(settings.get('instances.evict_interval', 300)))
+        config.add_subscriber(start_runner, NewRequest)
@@ -0,0 +1,352 @@
+'''
+Request and phase metrics, exposed in the Prometheus text format on
+/metrics.
+
+Each process (gunicorn worker, or worker pool process) keeps its own
+metrics and, if metrics.dir is set, periodically and on exit writes
+them to <metrics.dir>/<pid>-<start time>.json, so that /metrics can
+sum them over all processes. The files of processes that have exited
+are folded into <metrics.dir>/exited.json and removed, so counters
+don't go backwards when workers are replaced, and the directory
+doesn't grow.
+'''
+import atexit
+import errno
+import fcntl
+import json
+import multiprocessing.util
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from exercises_server import slowlog
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name: (type, help)
+METRICS = {
+    'exercises_requests_total': ('counter', "Requests handled, by route and status code"),
+    'exercises_request_errors_total': ('counter', "Requests that failed with a 5xx status, by route"),
+    'exercises_request_duration_seconds': ('histogram', "Request latency, by route"),
+    'exercises_phase_duration_seconds': ('histogram', "Time spent in each phase of handling requests"),
+}
+
+
+class Registry(object):
+    '''
+    The counters and histograms of one process, keyed by metric name
+    and a tuple of sorted (label, value) pairs.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # per-bucket (not cumulative) counts, sum and count
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+
+    def snapshot(self):
+        '''
+        Return the metrics as a JSON-compatible dict.
+        '''
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.iteritems()],
+                'histograms': [[name, dict(labels), list(buckets), total, count] for (name, labels), (buckets, total, count) in self.histograms.iteritems()],
+            }
+
+
+    def merge(self, snapshot):
+        '''
+        Add the metrics in +snapshot+ to these.
+        '''
+        for name, labels, value in snapshot['counters']:
+            self.inc(name, labels, value)
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.iteritems())))
+            with self._lock:
+                histogram = self.histograms.setdefault(key, [[0] * len(BUCKETS), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+
+
+    def render(self):
+        '''
+        Return the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self._lock:
+            for name in sorted(METRICS):
+                kind, help = METRICS[name]
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for (metric, labels), value in sorted(self.counters.iteritems()):
+                    if metric == name:
+                        lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                for (metric, labels), (buckets, total, count) in sorted(self.histograms.iteritems()):
+                    if metric == name:
+                        cumulative = 0
+                        for bound, bucketCount in zip(BUCKETS, buckets):
+                            cumulative += bucketCount
+                            lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', _number(bound)),)), cumulative))
+                        lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', '+Inf'),)), count))
+                        lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+                        lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"')) for label, value in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+_pid = os.getpid()
+_started = int(time.time() * 1000)
+
+
+def get_registry():
+    '''
+    Return this process's registry. A process forked from another
+    (e.g. a worker pool process) starts with an empty one, rather than
+    a copy of its parent's metrics.
+    '''
+    global registry, _pid, _started
+    if _pid != os.getpid():
+        registry = Registry()
+        _pid = os.getpid()
+        _started = int(time.time() * 1000)
+        # multiprocessing children exit without running atexit handlers
+        multiprocessing.util.Finalize(None, _flush_at_exit, exitpriority=0)
+    return registry
+
+
+# Where each process writes its metrics, or None to only report the
+# metrics of the process serving /metrics
+metrics_dir = None
+flush_interval = 5.0
+_lastFlushed = 0
+
+
+def flush(force=False):
+    '''
+    Write this process's metrics to the metrics directory, at most
+    every flush_interval seconds unless +force+ is true.
+    '''
+    global _lastFlushed
+    if metrics_dir is None or (not force and time.time() - _lastFlushed < flush_interval):
+        return
+    _lastFlushed = time.time()
+    snapshot = get_registry().snapshot()
+    try:
+        _write(_process_file(), snapshot)
+    except (IOError, OSError):
+        log.exception("Could not write metrics")
+
+
+def _flush_at_exit():
+    flush(force=True)
+
+atexit.register(_flush_at_exit)
+
+
+# <pid>-<start time in ms>.json
+_PROCESS_FILE = re.compile(r'^(\d+)-(\d+)\.json$')
+EXITED_FILE = 'exited.json'
+
+
+def _process_file():
+    get_registry()
+    return '%d-%d.json' % (_pid, _started)
+
+
+def _write(filename, data):
+    '''
+    Atomically replace +filename+ in the metrics directory with +data+
+    as JSON.
+    '''
+    fd, path = tempfile.mkstemp(dir=metrics_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(path, os.path.join(metrics_dir, filename))
+
+
+def _read(filename):
+    try:
+        with open(os.path.join(metrics_dir, filename)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        log.warning("Could not read metrics from %s" % filename)
+        return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def _fold_exited(filenames):
+    '''
+    Add the metrics of the process files +filenames+ to the exited
+    file, then remove them. The exited file lists the files folded
+    into it, so that ones left behind by a crash between the two steps
+    aren't added twice.
+    '''
+    exited = Registry()
+    folded = set()
+    if os.path.exists(os.path.join(metrics_dir, EXITED_FILE)):
+        snapshot = _read(EXITED_FILE)
+        if snapshot is None:
+            # don't replace totals that can't be read
+            return
+        exited.merge(snapshot)
+        folded = set(snapshot.get('folded', []))
+    present = set(os.listdir(metrics_dir))
+    folded &= present
+    for filename in filenames:
+        if filename in folded:
+            continue
+        snapshot = _read(filename)
+        if snapshot is not None:
+            exited.merge(snapshot)
+        folded.add(filename)
+    snapshot = exited.snapshot()
+    snapshot['folded'] = sorted(folded)
+    _write(EXITED_FILE, snapshot)
+    for filename in filenames:
+        os.remove(os.path.join(metrics_dir, filename))
+
+
+def collect():
+    '''
+    Return a Registry with the metrics of all processes summed,
+    folding the files of processes that have exited into the exited
+    file first.
+    '''
+    total = Registry()
+    total.merge(get_registry().snapshot())
+    if metrics_dir is None:
+        return total
+
+    with open(os.path.join(metrics_dir, '.lock'), 'w') as lock:
+        # one collector at a time, so files are folded only once
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        ownFile = _process_file()
+        latest = {}
+        processFiles = []
+        for filename in os.listdir(metrics_dir):
+            match = _PROCESS_FILE.match(filename)
+            if match and filename != ownFile:
+                pid, started = int(match.group(1)), int(match.group(2))
+                latest[pid] = max(latest.get(pid, 0), started)
+                processFiles.append((filename, pid, started))
+        running = []
+        exited = []
+        for filename, pid, started in processFiles:
+            # of several files with a reused pid, only the latest can
+            # belong to a running process
+            if started == latest[pid] and _is_running(pid):
+                running.append(filename)
+            else:
+                exited.append(filename)
+        if exited:
+            try:
+                _fold_exited(exited)
+            except (IOError, OSError):
+                log.exception("Could not fold exited processes' metrics")
+        for filename in running + [EXITED_FILE]:
+            if os.path.exists(os.path.join(metrics_dir, filename)):
+                snapshot = _read(filename)
+                if snapshot is not None:
+                    total.merge(snapshot)
+    return total
+
+
+@contextmanager
+def timer(phase):
+    '''
+    Record the time spent in the with block as +phase+, in the metrics
+    and in the slow request log.
+    '''
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        get_registry().observe('exercises_phase_duration_seconds', {'phase': phase}, elapsed)
+        slowlog.record_phase(phase, elapsed)
+        flush()
+
+
+def metrics_tween_factory(handler, registry):
+    '''
+    Tween recording the count, errors and latency of requests by
+    route.
+    '''
+    def metrics_tween(request):
+        start = time.time()
+        status = '500'
+        try:
+            response = handler(request)
+            status = str(response.status_int)
+            return response
+        finally:
+            matchedRoute = getattr(request, 'matched_route', None)
+            route = matchedRoute.name if matchedRoute else 'none'
+            metrics = get_registry()
+            metrics.inc('exercises_requests_total', {'route': route, 'status': status})
+            if status.startswith('5'):
+                metrics.inc('exercises_request_errors_total', {'route': route})
+            metrics.observe('exercises_request_duration_seconds', {'route': route}, time.time() - start)
+            flush()
+    return metrics_tween
+
+
+def setup_metrics(settings):
+    '''
+    Configure where and how often metrics are written from the
+    metrics.dir and metrics.flush_interval settings.
+    '''
+    global metrics_dir, flush_interval
+    metrics_dir = settings.get('metrics.dir') or None
+    flush_interval = float(settings.get('metrics.flush_interval', 5))
+    if metrics_dir is not None and not os.path.isdir(metrics_dir):
+        os.makedirs(metrics_dir)
+    log.info("metrics.dir: %s" % metrics_dir)
@@ -1,4 +1,10 @@
-from exercises_server.models.support import DBSession, Base
+from exercises_server.models.support import DBSession, StreamSession, Base
 
-from exercises_server.models.exercise import Exercise
+from exercises_server.models.exercise import Exercise, VersionConflict
 from exercises_server.models.current_version import CurrentVersion
+from exercises_server.models.branch_revision import BranchRevision
+from exercises_server.models.branch_change import BranchChange
+from exercises_server.models.blob import Blob
+from exercises_server.models.validation_result import ValidationResult
+from exercises_server.models.job import Job
+from exercises_server.models.exercise_instance import ExerciseInstance
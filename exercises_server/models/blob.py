@@ -0,0 +1,80 @@
+from sqlalchemy import (
+    Column,
+    BigInteger,
+    Integer,
+    String,
+    Binary,
+    )
+
+from exercises_server.models.support import Base, DBSession, insert_ignoring_conflicts
+from exercises_server.zips import ZipMember
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Blob(Base):
+    """
+    The compressed contents of an exercise zip member, stored once
+    however many exercise versions contain it, keyed by the SHA-1 of
+    the uncompressed contents.
+    """
+    __tablename__ = "blobs"
+
+    hash = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    crc = Column(BigInteger, nullable=False)
+    compress_type = Column(Integer, nullable=False)
+    data = Column(Binary, nullable=False)
+
+    def __str__(self):
+        return "<Blob hash=%s, size=%s>" % (self.hash, self.size)
+
+
+    def as_member(self, name):
+        return ZipMember(
+            name=name,
+            content_hash=self.hash,
+            size=self.size,
+            crc=self.crc,
+            compress_type=self.compress_type,
+            raw=self.data)
+
+
+    @classmethod
+    def get_many(cls, hashes):
+        """
+        Return a dict mapping each of the given +hashes+ that is
+        stored to its blob.
+        """
+        hashes = set(hashes)
+        if not hashes:
+            return {}
+        query = DBSession.query(Blob).filter(Blob.hash.in_(list(hashes)))
+        return dict((blob.hash, blob) for blob in query)
+
+
+    @classmethod
+    def store_members(cls, members):
+        """
+        Store the contents of the ZipMember instances +members+ that
+        aren't stored yet. Returns the number of new blobs. Another
+        request storing the same blobs concurrently is not an error.
+        """
+        if not members:
+            return 0
+        existing = set(hash for (hash,) in DBSession.query(Blob.hash).filter(
+            Blob.hash.in_(list(set(member.content_hash for member in members)))))
+        rows = []
+        for member in members:
+            if member.content_hash not in existing:
+                rows.append({
+                    'hash': member.content_hash,
+                    'size': member.size,
+                    'crc': member.crc,
+                    'compress_type': member.compress_type,
+                    'data': member.raw,
+                })
+                existing.add(member.content_hash)
+        insert_ignoring_conflicts(cls.__table__, rows)
+        return len(rows)
@@ -0,0 +1,83 @@
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Enum,
+    func,
+    )
+
+from exercises_server.models.support import Base, DBSession
+from exercises_server.models.branch_revision import BranchRevision
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class BranchChange(Base):
+    """
+    An append-only log of branch head changes. The sequence numbers
+    increase monotonically, so clients can follow the log from a
+    cursor instead of listing whole branches.
+    """
+    __tablename__ = "branch_changes"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    branch = Column(Enum('testing', 'published', name="BranchName"), nullable=False, index=True)
+    id = Column(String, nullable=False)
+    version = Column(String)  # None when retracted
+    change = Column(Enum('added', 'moved', 'retracted', name="BranchChangeType"), nullable=False)
+    created = Column(DateTime(timezone=True), default=func.now(), nullable=False)
+
+    def __json__(self, request):
+        return {
+            'seq': self.seq,
+            'id': self.id,
+            'version': self.version,
+            'change': self.change,
+        }
+
+
+    def __str__(self):
+        return "<BranchChange seq=%s, branch=%s, id=%s, version=%s, change=%s>" % (self.seq, self.branch, self.id, self.version, self.change)
+
+
+    @classmethod
+    def record(cls, branch, id, version, change):
+        """
+        Log a change of the +branch+ head of exercise +id+ and bump
+        the branch revision.
+
+        The revision is bumped first: its row stays locked until this
+        transaction ends, so that concurrent changes to the branch are
+        given their sequence numbers in commit order, and a client
+        following the log past one change can't miss an earlier one
+        that commits later.
+        """
+        BranchRevision.bump(branch)
+        entry = BranchChange(branch=branch, id=id, version=version, change=change)
+        DBSession.add(entry)
+        log.info("Recorded branch change: %s" % entry)
+        return entry
+
+
+    @classmethod
+    def get_since(cls, branch, since, limit):
+        """
+        Return up to +limit+ changes to +branch+ after sequence
+        number +since+, oldest first.
+        """
+        query = DBSession.query(BranchChange).filter(
+            BranchChange.branch == branch,
+            BranchChange.seq > since,
+        ).order_by(BranchChange.seq).limit(limit)
+        return query.all()
+
+
+    @classmethod
+    def get_cursor(cls, branch):
+        """
+        Return the sequence number of the latest change to +branch+,
+        or 0 if there are none.
+        """
+        return DBSession.query(func.max(BranchChange.seq)).filter(BranchChange.branch == branch).scalar() or 0
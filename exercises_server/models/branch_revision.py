@@ -0,0 +1,41 @@
+from sqlalchemy import (
+    Column,
+    Integer,
+    Enum,
+    )
+
+from exercises_server.models.support import Base, DBSession
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class BranchRevision(Base):
+    """
+    A counter per branch that is incremented whenever any head on the
+    branch changes, so that listings of the branch can be cached.
+    """
+    __tablename__ = "branch_revisions"
+
+    branch = Column(Enum('testing', 'published', name="BranchName"), primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
+    def __str__(self):
+        return "<BranchRevision, branch=%s, revision=%s>" % (self.branch, self.revision)
+
+
+    @classmethod
+    def get_revision(cls, branch):
+        row = DBSession.query(BranchRevision).get(branch)
+        return row.revision if row else 0
+
+
+    @classmethod
+    def bump(cls, branch):
+        """
+        Increment the revision of +branch+.
+        """
+        updated = DBSession.query(BranchRevision).filter(BranchRevision.branch == branch).update(
+            {BranchRevision.revision: BranchRevision.revision + 1}, synchronize_session=False)
+        if not updated:
+            DBSession.add(BranchRevision(branch=branch, revision=1))
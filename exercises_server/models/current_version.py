@@ -3,12 +3,14 @@ from sqlalchemy import (
     String,
     Enum,
     PrimaryKeyConstraint,
+    and_,
     )
 from sqlalchemy.orm import relationship, backref
 
 import json
 
 from exercises_server.models.support import Base, DBSession
+from exercises_server.models.branch_change import BranchChange
 from exercises_server.utils import now_utc, force_utc
 
 import logging
@@ -32,3 +34,56 @@ class CurrentVersion(Base):
     def get_by_id(cls, branch, id):
         query = DBSession.query(CurrentVersion)
         return query.get((branch, id))
+
+
+    @classmethod
+    def query_branch(cls, branch, after=None, limit=None, session=DBSession, template=None):
+        """
+        Return a query for the (id, version) pairs of the heads on
+        +branch+ in id order, starting after id +after+ and returning
+        at most +limit+ rows if given. If +template+ is given, only
+        templates (True) or static exercises (False) are returned.
+        """
+        query = session.query(CurrentVersion.id, CurrentVersion.version).filter(
+            CurrentVersion.branch == branch).order_by(CurrentVersion.id)
+        if template is not None:
+            from exercises_server.models.exercise import Exercise
+            query = query.join(Exercise, and_(
+                Exercise.id == CurrentVersion.id,
+                Exercise.version == CurrentVersion.version,
+            )).filter(Exercise.is_template == template)
+        if after is not None:
+            query = query.filter(CurrentVersion.id > after)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+
+    @classmethod
+    def set_head(cls, branch, id, version):
+        """
+        Point the +branch+ head of exercise +id+ at +version+,
+        recording the change if the head moved.
+        """
+        head = cls.get_by_id(branch, id)
+        if head is None:
+            head = CurrentVersion(branch=branch, id=id, version=version)
+            DBSession.add(head)
+            BranchChange.record(branch, id, version, 'added')
+        elif head.version != version:
+            head.version = version
+            BranchChange.record(branch, id, version, 'moved')
+        return head
+
+
+    @classmethod
+    def retract(cls, branch, id):
+        """
+        Remove the +branch+ head of exercise +id+, if there is one,
+        recording the change. Returns the removed head or None.
+        """
+        head = cls.get_by_id(branch, id)
+        if head is not None:
+            DBSession.delete(head)
+            BranchChange.record(branch, id, None, 'retracted')
+        return head
@@ -1,29 +1,59 @@
 from sqlalchemy import (
+    Boolean,
     Column,
     DateTime,
     String,
+    Text,
     Binary,
     PrimaryKeyConstraint,
+    and_,
+    or_,
+    tuple_,
     func,
     event,
     )
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, defer
 
-import json, base64
+import json, base64, zipfile, StringIO
 
 from exercises_server.models.support import Base, DBSession
+from exercises_server.models.current_version import CurrentVersion
+from exercises_server.models.blob import Blob
+from exercises_server import cache
+from exercises_server.instances import is_template_xml
+from exercises_server.metrics import timer
+from exercises_server.zips import read_members, build_zip
 from exercises_server.utils import now_utc, force_utc
 
 import logging
 log = logging.getLogger(__name__)
 
 
+class VersionConflict(ValueError):
+    '''
+    Raised when storing an exercise version that is already stored
+    with different contents. Versions are immutable, since generated
+    instances and clients' caches are keyed by them.
+    '''
+    pass
+
+
 class Exercise(Base):
     __tablename__ = "exercises"
 
     id = Column(String, nullable=False)
     version = Column(String, nullable=False)
-    data = Column(Binary, nullable=False)
+    # Exercises are stored either whole, as zip data (before content
+    # addressing was introduced), or as a JSON manifest of [name,
+    # hash, size] entries for the zip members, whose contents are
+    # stored in the blobs table.
+    data = Column(Binary)
+    manifest = Column(Text)
+    # Computed from the zip when it is stored, so that it needn't be
+    # unpacked to find out. None for exercises stored before these
+    # columns were added, or without a valid main.xml.
+    is_template = Column(Boolean, index=True)
+    main_xml_hash = Column(String)
     created = Column(DateTime(timezone=True), default=func.now(), nullable=False)
     last_updated = Column(DateTime(timezone=True))
 
@@ -33,7 +63,9 @@ class Exercise(Base):
         return {
             'id': self.id,
             'version': self.version,
-            'data_b64': base64.b64encode(self.data),
+            'data_b64': base64.b64encode(self.get_data()),
+            'is_template': self.is_template,
+            'main_xml_hash': self.main_xml_hash,
             'created': self.created.isoformat(),
             'last_updated': self.last_updated.isoformat() if self.last_updated else None,
         }
@@ -44,16 +76,205 @@ class Exercise(Base):
         self.last_updated = now_utc()
 
 
+    def introspect(self, members):
+        """
+        Set is_template and main_xml_hash from +members+, the list of
+        ZipMember instances of the exercise zip.
+        """
+        self.is_template = None
+        self.main_xml_hash = None
+        for member in members:
+            if member.name == 'main.xml':
+                self.main_xml_hash = member.content_hash
+                try:
+                    self.is_template = is_template_xml(member.contents())
+                except SyntaxError:
+                    # lxml's XMLSyntaxError; validation reports it
+                    pass
+
+
+    def members(self):
+        """
+        Return the (name, size) pair of each member of the exercise
+        zip, from the manifest if the zip is stored by member.
+        """
+        if self.manifest is not None:
+            return [(name, size) for name, hash, size in json.loads(self.manifest)]
+        return [(info.filename, info.file_size) for info in zipfile.ZipFile(StringIO.StringIO(self.data)).infolist()]
+
+
     def __str__(self):
         return "<Exercise id=%s, version=%s, created=%s, last_updated=%s>" % (self.id, self.version, self.created, self.last_updated)
 
 
+    def get_data(self, blobs=None):
+        """
+        Return the exercise zip data, rebuilding it from the stored
+        members if necessary. Pass prefetched +blobs+ (a dict from
+        hash to Blob) to avoid querying for them; any that are missing,
+        e.g. because the zip was cached when they were prefetched, are
+        queried.
+        """
+        if self.manifest is None:
+            return self.data
+
+        data = cache.zip_cache.get(self.manifest)
+        if data is None:
+            manifest = json.loads(self.manifest)
+            missing = [hash for name, hash, size in manifest if blobs is None or hash not in blobs]
+            if missing:
+                blobs = dict(blobs or {})
+                blobs.update(Blob.get_many(missing))
+            with timer('zip_build'):
+                data = build_zip([blobs[hash].as_member(name) for name, hash, size in manifest])
+            cache.zip_cache.put(self.manifest, data)
+        return data
+
+
+    @classmethod
+    def prefetch_blobs(cls, exercises):
+        """
+        Return the blobs needed to rebuild any of +exercises+ whose zip
+        data is not cached, in one query, for passing to get_data.
+        """
+        hashes = set()
+        for exercise in exercises:
+            if exercise.manifest is not None and cache.zip_cache.get(exercise.manifest) is None:
+                hashes.update(hash for name, hash, size in json.loads(exercise.manifest))
+        return Blob.get_many(hashes)
+
+
+    @classmethod
+    def store(cls, id, version, data):
+        """
+        Insert the exercise +id+ with the given +version+ and zip
+        +data+. Only zip members whose contents aren't stored yet are
+        added to the blobs table. Storing the same contents again is a
+        no-op apart from updating last_updated.
+
+        Raises VersionConflict if the version is already stored with
+        different contents.
+        """
+        exercise = cls.store_many([(id, version, data)])[0]
+        if isinstance(exercise, VersionConflict):
+            raise exercise
+        return exercise
+
+
+    @classmethod
+    def store_many(cls, entries):
+        """
+        Like store, for each (id, version, data) triple in +entries+,
+        but checking for stored members of all of them at once.
+        Returns a list of the stored exercises, in order, with a
+        VersionConflict in place of each entry that was not stored
+        because its version is stored with different contents.
+        """
+        with timer('zip_parse'):
+            entries = [(id, version, read_members(data)) for id, version, data in entries]
+        stored = cls.get_many_by_version_or_branch([(id, version) for id, version, members in entries], load_data=False)
+        conflicts = set()
+        for id, version, members in entries:
+            if (id, version) in stored and stored[(id, version)].contents_key() != contents_key(members):
+                conflicts.add((id, version))
+
+        storedMembers = [member for id, version, members in entries if (id, version) not in conflicts for member in members]
+        added = Blob.store_members(storedMembers)
+        log.info("Stored %d new of %d members" % (added, len(storedMembers)))
+
+        exercises = []
+        for id, version, members in entries:
+            if (id, version) in conflicts:
+                exercises.append(VersionConflict("Exercise %s version %s is already stored with different contents" % (id, version)))
+                continue
+            manifest = json.dumps([[member.name, member.content_hash, member.size] for member in members])
+            exercise = Exercise(id=id, version=version, data=None, manifest=manifest, last_updated=now_utc())
+            exercise.introspect(members)
+            exercises.append(DBSession.merge(exercise))
+        return exercises
+
+
+    def contents_key(self):
+        """
+        Return a value that is equal for exercises whose zips have the
+        same members, whatever their order or compression.
+        """
+        if self.manifest is not None:
+            return sorted((name, hash) for name, hash, size in json.loads(self.manifest))
+        return contents_key(read_members(self.data))
+
+
     @classmethod
     def get_by_id(cls, id, version):
         query = DBSession.query(Exercise)
         return query.get((id, version))
 
 
+    @classmethod
+    def get_by_version_or_branch(cls, id, version, load_data=True):
+        """
+        Return the exercise with the given +id+ and +version+, or None.
+        The +version+ may also be a branch name, in which case it is
+        resolved to the branch head in the same query.
+
+        If +load_data+ is false, the zip data is only loaded from the
+        database when it is first accessed.
+        """
+        query = cls._query(load_data)
+        if version in ['testing', 'published']:
+            query = query.join(CurrentVersion, and_(
+                CurrentVersion.id == Exercise.id,
+                CurrentVersion.version == Exercise.version,
+            )).filter(CurrentVersion.branch == version, CurrentVersion.id == id)
+        else:
+            query = query.filter(Exercise.id == id, Exercise.version == version)
+        return query.first()
+
+
+    @classmethod
+    def get_many_by_version_or_branch(cls, keys, load_data=True):
+        """
+        Like get_by_version_or_branch, but look up all the (id,
+        version) pairs in +keys+ with a single query. Returns a dict
+        mapping each pair that was found to its exercise.
+        """
+        versionKeys = set()
+        branchIds = {}
+        for id, version in keys:
+            if version in ['testing', 'published']:
+                branchIds.setdefault(version, set()).add(id)
+            else:
+                versionKeys.add((id, version))
+
+        conditions = [
+            and_(CurrentVersion.branch == branch, CurrentVersion.id.in_(ids))
+            for branch, ids in branchIds.iteritems()]
+        if versionKeys:
+            conditions.append(tuple_(Exercise.id, Exercise.version).in_(list(versionKeys)))
+        if not conditions:
+            return {}
+
+        query = cls._query(load_data).add_columns(CurrentVersion.branch).outerjoin(CurrentVersion, and_(
+            CurrentVersion.id == Exercise.id,
+            CurrentVersion.version == Exercise.version,
+        )).filter(or_(*conditions))
+
+        exercises = {}
+        for exercise, branch in query:
+            exercises[(exercise.id, exercise.version)] = exercise
+            if branch is not None:
+                exercises[(exercise.id, branch)] = exercise
+        return dict((key, exercises[key]) for key in keys if key in exercises)
+
+
+    @classmethod
+    def _query(cls, load_data):
+        query = DBSession.query(Exercise)
+        if not load_data:
+            query = query.options(defer(Exercise.data))
+        return query
+
+
     @classmethod
     def inserted(cls, mapper, connection, target):
         # ensure timestamps have timezones (SQLite doesn't support timezones)
@@ -68,5 +289,9 @@ class Exercise(Base):
         target.last_updated = force_utc(target.last_updated)
 
 
+def contents_key(members):
+    return sorted((member.name, member.content_hash) for member in members)
+
+
 event.listen(Exercise, 'after_insert', Exercise.inserted)
 event.listen(Exercise, 'load', Exercise.loaded)
@@ -0,0 +1,162 @@
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    Binary,
+    PrimaryKeyConstraint,
+    tuple_,
+    func,
+    event,
+    )
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from datetime import timedelta
+
+from exercises_server.models.support import Base, DBSession
+from exercises_server.utils import now_utc, force_utc
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ExerciseInstance(Base):
+    """
+    A generated instance of a template exercise. Versions are
+    immutable, so an instance never changes once it is stored.
+    """
+    __tablename__ = "exercise_instances"
+
+    # How often last_accessed is updated, to avoid a write on every read
+    ACCESS_RESOLUTION = timedelta(minutes=10)
+
+    id = Column(String, nullable=False)
+    version = Column(String, nullable=False)
+    seed = Column(Integer, nullable=False)
+    data = Column(Binary, nullable=False)
+    size = Column(Integer, nullable=False)
+    generation_time = Column(Float)  # seconds
+    created = Column(DateTime(timezone=True), default=func.now(), nullable=False)
+    last_accessed = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (PrimaryKeyConstraint('id', 'version', 'seed', name='exercise_instances_primary_key'),)
+
+    def __str__(self):
+        return "<ExerciseInstance id=%s, version=%s, seed=%s, size=%s>" % (self.id, self.version, self.seed, self.size)
+
+
+    def touch(self):
+        """
+        Record that the instance was read, for eviction.
+        """
+        now = now_utc()
+        if now - self.last_accessed >= self.ACCESS_RESOLUTION:
+            self.last_accessed = now
+
+
+    @classmethod
+    def get(cls, id, version, seed):
+        return DBSession.query(ExerciseInstance).get((id, version, seed))
+
+
+    @classmethod
+    def get_many(cls, keys):
+        """
+        Return a dict mapping each of the (id, version, seed) triples
+        in +keys+ that is stored to its instance, in one query.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        query = DBSession.query(ExerciseInstance).filter(
+            tuple_(ExerciseInstance.id, ExerciseInstance.version, ExerciseInstance.seed).in_(keys))
+        return dict(((instance.id, instance.version, instance.seed), instance) for instance in query)
+
+
+    @classmethod
+    def get_seeds(cls, id, version):
+        """
+        Return the set of seeds for which instances of the exercise
+        +id+ with the given +version+ are stored.
+        """
+        query = DBSession.query(ExerciseInstance.seed).filter(
+            ExerciseInstance.id == id,
+            ExerciseInstance.version == version)
+        return set(seed for seed, in query)
+
+
+    @classmethod
+    def store(cls, id, version, seed, data, generation_time=None):
+        """
+        Store a generated instance in its own transaction, so that it
+        is kept even if the request fails, and so that another process
+        storing the same instance concurrently doesn't fail this one.
+        Returns whether the instance was stored.
+        """
+        now = now_utc()
+        try:
+            with DBSession.bind.begin() as connection:
+                connection.execute(cls.__table__.insert().values(
+                    id=id, version=version, seed=seed, data=data, size=len(data),
+                    generation_time=generation_time, created=now, last_accessed=now))
+        except IntegrityError:
+            return False
+        return True
+
+
+    @classmethod
+    def total_size(cls):
+        return DBSession.query(func.coalesce(func.sum(ExerciseInstance.size), 0)).scalar()
+
+
+    @classmethod
+    def evict(cls, max_bytes):
+        """
+        Delete the least recently read instances until those left take
+        up at most +max_bytes+. Returns the number deleted.
+        """
+        excess = cls.total_size() - max_bytes
+        if excess <= 0:
+            return 0
+
+        keys = []
+        query = DBSession.query(ExerciseInstance.id, ExerciseInstance.version, ExerciseInstance.seed, ExerciseInstance.size).order_by(ExerciseInstance.last_accessed)
+        for id, version, seed, size in query.yield_per(1000):
+            keys.append((id, version, seed))
+            excess -= size
+            if excess <= 0:
+                break
+        for id, version, seed in keys:
+            cls._query_for(id, version).filter(ExerciseInstance.seed == seed).delete(synchronize_session=False)
+        log.info("Evicted %d instances" % len(keys))
+        return len(keys)
+
+
+    @classmethod
+    def purge(cls, id, version=None):
+        """
+        Delete the stored instances of exercise +id+, or only of its
+        +version+ if given. Returns the number deleted.
+        """
+        return cls._query_for(id, version).delete(synchronize_session=False)
+
+
+    @classmethod
+    def _query_for(cls, id, version=None):
+        query = DBSession.query(ExerciseInstance).filter(ExerciseInstance.id == id)
+        if version is not None:
+            query = query.filter(ExerciseInstance.version == version)
+        return query
+
+
+    @classmethod
+    def loaded(cls, target, context):
+        # ensure timestamps have timezones (SQLite doesn't support
+        # timezones), without marking the instance as modified
+        set_committed_value(target, 'created', force_utc(target.created))
+        set_committed_value(target, 'last_accessed', force_utc(target.last_accessed))
+
+
+event.listen(ExerciseInstance, 'load', ExerciseInstance.loaded)
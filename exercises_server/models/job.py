@@ -0,0 +1,110 @@
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Text,
+    Binary,
+    func,
+    )
+
+import json
+
+from exercises_server.models.support import Base, DBSession
+from exercises_server.utils import now_utc, force_utc
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Job(Base):
+    """
+    A unit of background work, queued in the database and run by the
+    job runners in exercises_server.jobs.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)  # also the queue order
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='queued', index=True)  # queued, running, succeeded or failed
+    exercise_id = Column(String)
+    version = Column(String)
+    data = Column(Binary)  # input data, dropped once the job has finished
+    result = Column(Text)  # JSON
+    created = Column(DateTime(timezone=True), default=func.now(), nullable=False)
+    started = Column(DateTime(timezone=True))
+    finished = Column(DateTime(timezone=True))
+
+    def __json__(self, request):
+        info = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'exercise_id': self.exercise_id,
+            'version': self.version,
+            'created': force_utc(self.created).isoformat(),
+            'started': force_utc(self.started).isoformat() if self.started else None,
+            'finished': force_utc(self.finished).isoformat() if self.finished else None,
+            'result': json.loads(self.result) if self.result else None,
+        }
+        if self.status == 'queued':
+            info['queue_position'] = self.queue_position()
+        return info
+
+
+    def __str__(self):
+        return "<Job id=%s, kind=%s, status=%s, exercise_id=%s, version=%s>" % (self.id, self.kind, self.status, self.exercise_id, self.version)
+
+
+    def queue_position(self):
+        """
+        Return the number of queued jobs ahead of this one.
+        """
+        return DBSession.query(Job).filter(Job.status == 'queued', Job.id < self.id).count()
+
+
+    def finish(self, status, result):
+        self.status = status
+        self.result = json.dumps(result)
+        self.finished = now_utc()
+        self.data = None
+
+
+    @classmethod
+    def enqueue(cls, kind, exercise_id=None, version=None, data=None):
+        job = Job(kind=kind, status='queued', exercise_id=exercise_id, version=version, data=data, created=now_utc())
+        DBSession.add(job)
+        DBSession.flush()  # assign the id
+        log.info("Queued job: %s" % job)
+        return job
+
+
+    @classmethod
+    def get_by_id(cls, id):
+        return DBSession.query(Job).get(id)
+
+
+    @classmethod
+    def claim_next(cls, stale_before=None):
+        """
+        Mark the oldest queued job (or a job that has been running
+        since before +stale_before+, presumably because its runner
+        died) as running and return its id, or None if there are none.
+        Safe against other runners claiming jobs concurrently.
+        """
+        while True:
+            query = DBSession.query(Job.id, Job.status, Job.started)
+            if stale_before is not None:
+                query = query.filter((Job.status == 'queued') | ((Job.status == 'running') & (Job.started < stale_before)))
+            else:
+                query = query.filter(Job.status == 'queued')
+            row = query.order_by(Job.id).first()
+            if row is None:
+                return None
+
+            # only one runner can win the update
+            claimed = DBSession.query(Job).filter(
+                Job.id == row.id, Job.status == row.status, Job.started == row.started,
+            ).update({Job.status: 'running', Job.started: now_utc()}, synchronize_session=False)
+            if claimed:
+                return row.id
@@ -11,7 +11,39 @@ from sqlalchemy.orm import (
     sessionmaker,
     )
 
-from zope.sqlalchemy import ZopeTransactionExtension
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 
-DBSession = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+from zope.sqlalchemy import ZopeTransactionExtension, mark_changed
+
+from exercises_server.replicas import RoutingSession
+
+# Bound to the primary database, but reading from a replica in views
+# decorated with replicas.read_only
+DBSession = scoped_session(sessionmaker(class_=RoutingSession, extension=ZopeTransactionExtension()))
 Base = declarative_base()
+
+# Plain sessions, outside the request transaction, for work that
+# outlives the view, such as streamed responses. Close them when done.
+StreamSession = sessionmaker()
+
+
+def insert_ignoring_conflicts(table, rows):
+    """
+    Insert the dicts +rows+ into +table+ in the request transaction,
+    skipping any whose primary key is already taken, including by a
+    concurrent transaction, instead of failing with an IntegrityError.
+    For immutable, content-addressed rows, where whichever insert wins
+    stores the same values.
+    """
+    if not rows:
+        return
+    dialect = DBSession.bind.dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql_insert(table).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = table.insert().prefix_with('OR IGNORE')
+    else:
+        statement = table.insert()
+    DBSession.execute(statement, rows)
+    # not tracked by the session, so tell the transaction about it
+    mark_changed(DBSession())
@@ -0,0 +1,72 @@
+from sqlalchemy import (
+    Column,
+    Boolean,
+    DateTime,
+    String,
+    Text,
+    PrimaryKeyConstraint,
+    func,
+    )
+
+import json
+
+from exercises_server.models.support import Base, DBSession, insert_ignoring_conflicts
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ValidationResult(Base):
+    """
+    The result of validating an exercise zip, keyed by the hash of the
+    zip data and the version of the validator, so that identical
+    uploads need not be validated again.
+    """
+    __tablename__ = "validation_results"
+
+    content_hash = Column(String, nullable=False)
+    validator_version = Column(String, nullable=False)
+    validated = Column(Boolean, nullable=False)
+    result = Column(Text, nullable=False)
+    created = Column(DateTime(timezone=True), default=func.now(), nullable=False)
+
+    __table_args__ = (PrimaryKeyConstraint('content_hash', 'validator_version', name='validation_results_primary_key'),)
+
+    def __str__(self):
+        return "<ValidationResult content_hash=%s, validator_version=%s, validated=%s>" % (self.content_hash, self.validator_version, self.validated)
+
+
+    @classmethod
+    def lookup(cls, content_hash, validator_version):
+        """
+        Return the stored validation result dict, or None.
+        """
+        row = DBSession.query(ValidationResult).get((content_hash, validator_version))
+        return json.loads(row.result) if row else None
+
+
+    @classmethod
+    def lookup_many(cls, content_hashes, validator_version):
+        """
+        Return a dict mapping each of +content_hashes+ with a stored
+        result to its validation result dict.
+        """
+        query = DBSession.query(ValidationResult).filter(
+            ValidationResult.validator_version == validator_version,
+            ValidationResult.content_hash.in_(list(set(content_hashes))))
+        return dict((row.content_hash, json.loads(row.result)) for row in query)
+
+
+    @classmethod
+    def record(cls, content_hash, validator_version, result):
+        """
+        Store the validation +result+ dict, unless a result for the
+        same content and validator is already stored, as a concurrent
+        validation of the same upload may have done.
+        """
+        insert_ignoring_conflicts(cls.__table__, [{
+            'content_hash': content_hash,
+            'validator_version': validator_version,
+            'validated': bool(result['validated']),
+            'result': json.dumps(result),
+        }])
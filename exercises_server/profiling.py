@@ -0,0 +1,157 @@
+'''
+Opt-in profiling of individual requests.
+
+With profiling.enabled, a sample of requests (profiling.rate, a
+fraction) and any request sending the profiling.header header with the
+profiling.secret value are run under cProfile. Worker pool tasks are
+profiled in their worker processes, under the usual pool limits, and
+their stats added to the request's, so that template evaluation and
+validation show up in the profile. Each profile is written to
+profiling.dir as <request_id>.prof, in the pstats format, with a
+<request_id>.json file describing the request. Only the newest
+profiling.max_files profiles are kept.
+
+Profiles are listed by GET /admin/profiles and downloaded by GET
+/admin/profiles/<request_id>.
+'''
+import cProfile
+import glob
+import hmac
+import json
+import os
+import pstats
+import random
+import time
+
+from exercises_server import workers
+from exercises_server.utils import now_utc
+
+import logging
+log = logging.getLogger(__name__)
+
+
+enabled = False
+rate = 0.0
+header = 'X-Profile'
+# The value the header must have, or None to ignore the header
+secret = None
+profile_dir = None
+max_files = 100
+
+
+def should_profile(request):
+    value = request.headers.get(header)
+    if secret is not None and value is not None and hmac.compare_digest(value, secret):
+        return True
+    return rate > 0 and random.random() < rate
+
+
+class TaskStats(object):
+    '''
+    The stats dict of a task profiled in a worker process, in the form
+    pstats.Stats loads from a Profile.
+    '''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+
+    def create_stats(self):
+        pass
+
+
+def profile_path(requestId, extension):
+    return os.path.join(profile_dir, '%s.%s' % (requestId, extension))
+
+
+def write_profile(request, profile, taskStats, duration, status):
+    stats = pstats.Stats(profile)
+    for taskStat in taskStats:
+        stats.add(TaskStats(taskStat))
+    stats.dump_stats(profile_path(request.request_id, 'prof'))
+    matchedRoute = getattr(request, 'matched_route', None)
+    with open(profile_path(request.request_id, 'json'), 'w') as f:
+        json.dump({
+            'request_id': request.request_id,
+            'method': request.method,
+            'path': request.path_qs,
+            'route': matchedRoute.name if matchedRoute else None,
+            'status': status,
+            'duration': duration,
+            'created': now_utc().isoformat(),
+        }, f)
+    log.info("Wrote profile of request %s (%.3fs)" % (request.request_id, duration))
+    prune()
+
+
+def prune():
+    '''
+    Delete the oldest profiles beyond max_files.
+    '''
+    paths = sorted(glob.glob(os.path.join(profile_dir, '*.prof')), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - max_files, 0)]:
+        for extension in ('prof', 'json'):
+            try:
+                os.remove(path[:-len('prof')] + extension)
+            except OSError:
+                pass
+
+
+def list_profiles():
+    '''
+    Return the descriptions of the stored profiles, newest first.
+    '''
+    profiles = []
+    for path in glob.glob(os.path.join(profile_dir, '*.json')):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (IOError, ValueError):
+            continue
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def profiling_tween_factory(handler, registry):
+    '''
+    Tween running sampled requests under cProfile.
+    '''
+    def profiling_tween(request):
+        if not should_profile(request):
+            return handler(request)
+
+        profile = cProfile.Profile()
+        start = time.time()
+        status = 500
+        try:
+            with workers.profiled() as taskStats:
+                response = profile.runcall(handler, request)
+            status = response.status_int
+            return response
+        finally:
+            try:
+                write_profile(request, profile, taskStats, time.time() - start, status)
+            except (IOError, OSError):
+                log.exception("Could not write profile")
+    return profiling_tween
+
+
+def setup_profiling(settings, config):
+    '''
+    Add the profiling tween to +config+ if profiling.enabled, and
+    configure it from the other profiling.* settings.
+    '''
+    global enabled, rate, header, secret, profile_dir, max_files
+    enabled = settings.get('profiling.enabled', 'false').lower() in ('true', '1', 'yes', 'on')
+    if not enabled:
+        return
+
+    rate = float(settings.get('profiling.rate', 0))
+    header = settings.get('profiling.header', 'X-Profile')
+    secret = settings.get('profiling.secret') or None
+    profile_dir = settings['profiling.dir']
+    max_files = int(settings.get('profiling.max_files', 100))
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    config.add_tween('exercises_server.profiling.profiling_tween_factory')
+    log.info("Profiling %s of requests and those with %s to %s" % (rate, header, profile_dir))
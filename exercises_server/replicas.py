@@ -0,0 +1,104 @@
+'''
+Routing of read-only views to read replicas of the database.
+
+Views decorated with read_only query a replica from the
+replicas.urls setting, chosen at random per request; everything
+else, including any flush, goes to the primary. Views decorated with
+writes set a cookie telling the client's following requests to read
+from the primary for replicas.lag seconds, so that clients
+which keep cookies read their own writes.
+'''
+import random
+import threading
+import time
+
+from pyramid.response import Response
+from pyramid.settings import aslist
+from sqlalchemy.orm import Session
+
+from exercises_server.dbpool import make_engine
+
+import logging
+log = logging.getLogger(__name__)
+
+
+COOKIE_NAME = 'exercises_read_primary'
+
+replicas = []
+replica_lag = 10
+
+_local = threading.local()
+
+
+class RoutingSession(Session):
+    '''
+    A session that reads from the replica chosen for the current
+    request, if any, and otherwise uses its configured bind.
+    '''
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = current_replica()
+        if replica is not None and not self._flushing:
+            return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def current_replica():
+    return getattr(_local, 'replica', None)
+
+
+def reads_primary(request):
+    '''
+    Return whether +request+ comes from a client that wrote recently.
+    '''
+    try:
+        return float(request.cookies.get(COOKIE_NAME, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_only(view):
+    '''
+    View decorator routing the view's queries to a replica.
+    '''
+    def read_only_view(context, request):
+        if not replicas or reads_primary(request):
+            return view(context, request)
+        _local.replica = random.choice(replicas)
+        try:
+            return view(context, request)
+        finally:
+            _local.replica = None
+    return read_only_view
+
+
+def writes(view):
+    '''
+    View decorator making the client read from the primary for the
+    next replica_lag seconds.
+    '''
+    def writes_view(context, request):
+        response = view(context, request)
+        if replicas:
+            # rendered views' responses are made from request.response
+            target = response if isinstance(response, Response) else request.response
+            target.set_cookie(COOKIE_NAME, str(int(time.time()) + replica_lag + 1), max_age=replica_lag + 1, httponly=True)
+        return response
+    return writes_view
+
+
+def setup_replicas(settings):
+    '''
+    Create engines for the replicas in the replicas.urls setting,
+    a whitespace-separated list of database URLs, with the same pool
+    settings as the primary.
+    '''
+    global replicas, replica_lag
+    replicas = []
+    for url in aslist(settings.get('replicas.urls', '')):
+        replicaSettings = dict(settings)
+        replicaSettings['sqlalchemy.url'] = url
+        replicas.append(make_engine(replicaSettings, 'sqlalchemy.'))
+    replica_lag = int(settings.get('replicas.lag', 10))
+    log.info("Reading from %d replicas" % len(replicas))
+    return replicas
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import itertools
+import subprocess
+import tempfile
+import transaction
+import StringIO
+import zipfile
+from base64 import b64encode
+from multiprocessing.pool import ThreadPool
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from webob import Request
+
+from ..instances import is_template, NotATemplate
+from ..zips import build_instance_zip
+
+
+# The operations that can be benchmarked, in the order they are run
+OPERATIONS = ['list', 'read_static', 'read_seeded', 'update', 'publish']
+
+
+def make_exercise_zip(index, template, memberBytes):
+    '''
+    Return the zip data of a synthetic exercise with a main.xml (with a
+    <logic> element if +template+) and an image of +memberBytes+
+    random bytes, which don't compress, like real PNGs.
+    '''
+    mainXml = '<exercise>%s<problem>Exercise %s: what is 1 + 1?</problem></exercise>' % ('<logic/>' if template else '', index)
+    zipBytes = StringIO.StringIO()
+    zipArchive = zipfile.ZipFile(zipBytes, 'w', compression=zipfile.ZIP_DEFLATED)
+    zipArchive.writestr('main.xml', mainXml)
+    zipArchive.writestr('figure.png', os.urandom(memberBytes))
+    zipArchive.close()
+    return zipBytes.getvalue()
+
+
+def stub_generate_instance_zip(data, random_seed, template=None):
+    '''
+    Stand-in for instances.generate_instance_zip, for when the monassis
+    library isn't installed. It does the zip work of a real instance
+    (reading, and writing a new main.xml and the other members), but
+    not the template evaluation.
+    '''
+    if template is None:
+        template = is_template(data)
+    if not template:
+        raise NotATemplate("Static exercise cannot have a random seed")
+    templateZip = zipfile.ZipFile(StringIO.StringIO(data))
+    mainXml = templateZip.read('main.xml').replace('<logic/>', '<seed>%d</seed>' % random_seed)
+    files = dict((info.filename, templateZip.read(info)) for info in templateZip.infolist() if info.filename != 'main.xml')
+    return build_instance_zip(data, mainXml, files)
+
+
+def stub_validate_exercise(data):
+    '''
+    Stand-in for instances.validate_exercise, for when the monassis
+    library isn't installed.
+    '''
+    zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml')
+    return {'validated': True}
+
+
+def use_stubs():
+    from exercises_server import views, validation, warmup
+    views.generate_instance_zip = stub_generate_instance_zip
+    warmup.generate_instance_zip = stub_generate_instance_zip
+    validation.validate_exercise = stub_validate_exercise
+
+
+def seed_catalog(count, templateFraction, memberBytes):
+    '''
+    Store +count+ synthetic exercises on both branches, of which
+    +templateFraction+ are templates. Returns the (static ids,
+    template ids) lists.
+    '''
+    from exercises_server.models import Exercise, CurrentVersion
+
+    staticIds = []
+    templateIds = []
+    for index in range(count):
+        template = index < count * templateFraction
+        id = '%s%06d' % ('template' if template else 'static', index)
+        (templateIds if template else staticIds).append(id)
+        with transaction.manager:
+            Exercise.store(id, '1', make_exercise_zip(index, template, memberBytes))
+            CurrentVersion.set_head('testing', id, '1')
+            CurrentVersion.set_head('published', id, '1')
+    return staticIds, templateIds
+
+
+class Benchmark(object):
+    '''
+    Builds the requests for each operation against a seeded catalog.
+    '''
+
+    def __init__(self, staticIds, templateIds, memberBytes):
+        self.staticIds = staticIds
+        self.templateIds = templateIds
+        self.allIds = staticIds + templateIds
+        self.memberBytes = memberBytes
+        # unique seeds and versions, so that every seeded read and
+        # update does the full work rather than hitting a cache
+        self.counter = itertools.count(1000)
+
+
+    def json_request(self, path, method, params):
+        return Request.blank(path, method=method, body=json.dumps(params), content_type='application/json')
+
+
+    def request(self, operation):
+        if operation == 'list':
+            return self.json_request('/list', 'GET', {'branch': 'published'})
+        if operation == 'read_static':
+            return self.json_request('/read', 'GET', {'id': random.choice(self.staticIds)})
+        if operation == 'read_seeded':
+            return self.json_request('/read', 'GET', {'id': random.choice(self.templateIds), 'random_seed': next(self.counter)})
+        if operation == 'update':
+            index = next(self.counter)
+            return self.json_request('/update', 'PUT', {
+                'id': random.choice(self.allIds),
+                'version': str(index),
+                'data_base64': b64encode(make_exercise_zip(index, random.random() < 0.5, self.memberBytes))})
+        if operation == 'publish':
+            return self.json_request('/publish', 'PUT', {'id': random.choice(self.allIds), 'version': 'testing'})
+        raise ValueError("Unknown operation %s" % operation)
+
+
+def percentile(values, fraction):
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def run(app, benchmark, operation, concurrency, count):
+    '''
+    Send +count+ requests for +operation+, +concurrency+ at a time, and
+    return the throughput and latency statistics.
+    '''
+    def send(i):
+        request = benchmark.request(operation)
+        start = time.time()
+        response = request.get_response(app)
+        return time.time() - start, response.status_int < 400
+
+    threads = ThreadPool(concurrency)
+    start = time.time()
+    results = threads.map(send, range(count))
+    elapsed = time.time() - start
+    threads.close()
+
+    latencies = sorted(latency for latency, ok in results)
+    return {
+        'operation': operation,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': sum(1 for latency, ok in results if not ok),
+        'throughput': count / elapsed,
+        'mean': sum(latencies) / count,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Benchmark the REST API in-process against a synthetic '
+            'catalog in a temporary SQLite database, and write the '
+            'throughput and latency of each operation as JSON.')
+    parser.add_argument('config_uri', nargs='?', default='test.ini')
+    parser.add_argument('--exercises', type=int, default=200, help='number of exercises to seed (default: 200)')
+    parser.add_argument('--templates', type=float, default=0.5, help='fraction of them that are templates (default: 0.5)')
+    parser.add_argument('--member-bytes', type=int, default=20000, help='size of the image in each exercise (default: 20000)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per operation and concurrency (default: 200)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], help='concurrency levels (default: 1 4 8)')
+    parser.add_argument('--operations', nargs='+', default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument('--stub', action='store_true', help='stub instance generation and validation, as when monassis is not installed')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for choosing exercises (default: 0)')
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+
+    # A file database, since each thread gets its own in-memory one,
+    # and no debug toolbar
+    tempDir = tempfile.mkdtemp()
+    settings['sqlalchemy.url'] = 'sqlite:///%s' % os.path.join(tempDir, 'benchmark.sqlite')
+    settings['pyramid.includes'] = 'pyramid_tm'
+    settings['jobs.runner'] = 'false'
+    try:
+        try:
+            import monassis
+        except ImportError:
+            args.stub = True
+        if args.stub:
+            use_stubs()
+
+        from exercises_server import main as make_app
+        from exercises_server.models import Base
+        app = make_app({}, **settings)
+        Base.metadata.create_all()
+
+        random.seed(args.seed)
+        staticIds, templateIds = seed_catalog(args.exercises, args.templates, args.member_bytes)
+        benchmark = Benchmark(staticIds, templateIds, args.member_bytes)
+
+        results = []
+        for operation in args.operations:
+            for concurrency in args.concurrency:
+                result = run(app, benchmark, operation, concurrency, args.requests)
+                sys.stderr.write('%(operation)-12s c=%(concurrency)-3d %(throughput)8.1f req/s  p50 %(p50).4fs  p99 %(p99).4fs  errors %(errors)d\n' % result)
+                results.append(result)
+    finally:
+        shutil.rmtree(tempDir)
+
+    report = json.dumps({
+        'revision': git_revision(),
+        'config': {
+            'config_uri': args.config_uri,
+            'exercises': args.exercises,
+            'templates': args.templates,
+            'member_bytes': args.member_bytes,
+            'requests': args.requests,
+            'stub': args.stub,
+            'workers.processes': settings.get('workers.processes', '0'),
+        },
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
@@ -0,0 +1,47 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Base,
+    Exercise,
+    )
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          '(example: "%s development.ini")\n\n'
+          'Move the zip data of exercises stored whole into the\n'
+          'content-addressed blobs table.' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    keys = DBSession.query(Exercise.id, Exercise.version).filter(Exercise.manifest == None).all()
+    for i, (id, version) in enumerate(keys):
+        exercise = Exercise.get_by_id(id, version)
+        lastUpdated = exercise.last_updated
+        Exercise.store(id, version, exercise.data).last_updated = lastUpdated
+        # commit as we go to keep the transactions small
+        transaction.commit()
+        print('%d/%d %s %s' % (i + 1, len(keys), id, version))
@@ -0,0 +1,55 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Base,
+    BranchRevision,
+    Exercise,
+    )
+from ..zips import read_members
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          '(example: "%s development.ini")\n\n'
+          'Set is_template and main_xml_hash for exercises stored\n'
+          'before those columns were added.' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    keys = DBSession.query(Exercise.id, Exercise.version).filter(Exercise.main_xml_hash == None).all()
+    for i, (id, version) in enumerate(keys):
+        exercise = Exercise.get_by_id(id, version)
+        exercise.introspect(read_members(exercise.get_data()))
+        # commit as we go to keep the transactions small
+        transaction.commit()
+        print('%d/%d %s %s' % (i + 1, len(keys), id, version))
+
+    if keys:
+        # listings filtered by type have changed, so must not be
+        # served from caches keyed by the branch revisions
+        for branch in ['testing', 'published']:
+            BranchRevision.bump(branch)
+        transaction.commit()
@@ -0,0 +1,44 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Base,
+    ExerciseInstance,
+    )
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <id> [version]\n'
+          '(example: "%s development.ini 0a1b2c3d")\n\n'
+          'Delete the stored instances of an exercise, or of one\n'
+          'version of it.' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) not in (3, 4):
+        usage(argv)
+    id = argv[2]
+    version = argv[3] if len(argv) == 4 else None
+
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    count = ExerciseInstance.purge(id, version)
+    transaction.commit()
+    print('Deleted %d instances' % count)
@@ -0,0 +1,53 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Base,
+    Exercise,
+    CurrentVersion,
+    )
+from ..warmup import setup_warmup, warm_exercise
+from ..workers import setup_worker_pool
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [testing|published]\n'
+          '(example: "%s development.ini")\n\n'
+          'Pre-generate the warmup.seeds instances of every template\n'
+          'on a branch (default: published).' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) not in (2, 3):
+        usage(argv)
+    branch = argv[2] if len(argv) == 3 else 'published'
+    if branch not in ['testing', 'published']:
+        usage(argv)
+
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    setup_worker_pool(settings)
+    setup_warmup(settings)
+
+    keys = CurrentVersion.query_branch(branch).all()
+    for i, (id, version) in enumerate(keys):
+        count = warm_exercise(Exercise.get_by_id(id, version))
+        # commit as we go to keep the transactions small
+        transaction.commit()
+        print('%d/%d %s %s: %d instances' % (i + 1, len(keys), id, version, count))
@@ -0,0 +1,146 @@
+'''
+Slow request log.
+
+Requests taking longer than slow_log.threshold seconds are logged as a
+JSON line with their route, exercise id, version and seed, the time
+spent in each phase (see metrics.timer) and the SQL statements they
+ran with their durations, collected from SQLAlchemy cursor events. The
+log line carries the request id like all other request logging.
+'''
+import threading
+import time
+from json import dumps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import logging
+log = logging.getLogger(__name__)
+
+
+threshold = 0
+max_queries = 50
+
+_local = threading.local()
+
+
+class Trace(object):
+    '''
+    The phases and SQL statements of the request being handled by the
+    current thread.
+    '''
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = []
+        self.query_count = 0
+        self.query_time = 0.0
+
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+
+    def add_query(self, statement, seconds):
+        self.query_count += 1
+        self.query_time += seconds
+        if len(self.queries) < max_queries:
+            self.queries.append({'statement': statement[:1000], 'duration': round(seconds, 6)})
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def record_phase(phase, seconds):
+    '''
+    Add +seconds+ to the time of +phase+ in the current request, if it
+    is being traced.
+    '''
+    trace = current_trace()
+    if trace is not None:
+        trace.add_phase(phase, seconds)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace() is not None:
+        conn.info.setdefault('query_start', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace()
+    if trace is not None and conn.info.get('query_start'):
+        trace.add_query(statement, time.time() - conn.info['query_start'].pop())
+
+
+# The largest JSON body that is decoded again for its params; larger
+# ones are uploads, which aren't worth parsing twice just to log them
+max_params_body = 65536
+
+
+def request_params(request):
+    '''
+    Return the exercise id, version and seed of +request+, if any.
+    '''
+    params = None
+    # raw zip uploads have been read from the body stream already
+    if request.content_type != 'application/zip' and (request.content_length or 0) <= max_params_body:
+        try:
+            params = request.json_body
+        except ValueError:
+            pass
+    if not isinstance(params, dict):
+        params = request.GET
+    return dict((key, params.get(key)) for key in ('id', 'version', 'random_seed') if params.get(key) is not None)
+
+
+def slow_request_tween_factory(handler, registry):
+    '''
+    Tween tracing each request and logging it if it is slow.
+    '''
+    def slow_request_tween(request):
+        _local.trace = trace = Trace()
+        start = time.time()
+        status = 500
+        try:
+            response = handler(request)
+            status = response.status_int
+            return response
+        finally:
+            _local.trace = None
+            duration = time.time() - start
+            if duration >= threshold:
+                matchedRoute = getattr(request, 'matched_route', None)
+                info = {
+                    'request_id': request.request_id,
+                    'route': matchedRoute.name if matchedRoute else None,
+                    'method': request.method,
+                    'path': request.path_qs,
+                    'status': status,
+                    'duration': round(duration, 6),
+                    'phases': dict((phase, round(seconds, 6)) for phase, seconds in trace.phases.iteritems()),
+                    'query_count': trace.query_count,
+                    'query_time': round(trace.query_time, 6),
+                    'queries': trace.queries,
+                }
+                info.update(request_params(request))
+                log.warning("SLOW REQUEST <> %s" % dumps(info))
+    return slow_request_tween
+
+
+def setup_slow_log(settings, config):
+    '''
+    Add the slow request tween to +config+ if slow_log.threshold is
+    set, and configure it from the other slow_log.* settings.
+    '''
+    global threshold, max_queries
+    threshold = float(settings.get('slow_log.threshold', 0))
+    max_queries = int(settings.get('slow_log.max_queries', 50))
+    if not threshold:
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    config.add_tween('exercises_server.slowlog.slow_request_tween_factory')
+    log.info("Logging requests slower than %ss" % threshold)
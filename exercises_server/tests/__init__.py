@@ -6,11 +6,16 @@ import exercises_server.requests
 from exercises_server.models.support import DBSession
 from exercises_server.models import Base, Exercise, CurrentVersion
 
-def init_testing_app():
+def init_testing_app(**settings):
+    """
+    Return a TestApp for the test.ini app, with any +settings+ added.
+    """
     from exercises_server import main
     from webtest import TestApp
 
-    app = main({}, **get_appsettings('test.ini#main'))
+    appSettings = get_appsettings('test.ini#main')
+    appSettings.update(settings)
+    app = main({}, **appSettings)
     return TestApp(app)
 
 
@@ -18,3 +23,64 @@ def init_testing_db():
     # NOTE: init_testing_app must have been called first
     Base.metadata.create_all()
     return DBSession()
+
+
+def make_exercise_zip(template=False, files={}, problem='What is 1 + 1?'):
+    """
+    Return the zip data of a minimal exercise, with a <logic>
+    element if +template+ is true and the extra +files+ given.
+    """
+    import StringIO, zipfile
+
+    mainXml = '<exercise>%s<problem>%s</problem></exercise>' % ('<logic/>' if template else '', problem)
+    zipBytes = StringIO.StringIO()
+    zipArchive = zipfile.ZipFile(zipBytes, 'w', compression=zipfile.ZIP_DEFLATED)
+    zipArchive.writestr('main.xml', mainXml)
+    for filename, data in files.iteritems():
+        zipArchive.writestr(filename, data)
+    zipArchive.close()
+    return zipBytes.getvalue()
+
+
+def add_exercise(id, version, data, branches=()):
+    """
+    Store an exercise directly in the testing database and point the
+    given +branches+ at it.
+    """
+    DBSession.add(Exercise(id=id, version=version, data=data))
+    for branch in branches:
+        DBSession.merge(CurrentVersion(branch=branch, id=id, version=version))
+    transaction.commit()
+
+
+def fake_generate_instance_zip(data, random_seed, template=None):
+    """
+    Stand-in for instances.generate_instance_zip that does not need
+    the monassis library. Exercises whose main.xml mentions "broken"
+    raise a RuntimeError.
+    """
+    import StringIO, zipfile
+    from exercises_server.instances import is_template, NotATemplate
+    if template is None:
+        template = is_template(data)
+    if not template:
+        raise NotATemplate("Static exercise cannot have a random seed")
+    if 'broken' in zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml'):
+        raise RuntimeError('broken')
+    return 'instance %d of %s' % (random_seed, data)
+
+
+def fake_validate_exercise(data):
+    """
+    Stand-in for instances.validate_exercise that does not need the
+    monassis library. Exercises whose main.xml mentions "invalid"
+    fail to validate, and ones that mention "broken" raise a
+    RuntimeError.
+    """
+    import StringIO, zipfile
+    mainXml = zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml')
+    if 'broken' in mainXml:
+        raise RuntimeError('broken')
+    if 'invalid' in mainXml:
+        return {'validated': False, 'exception': "ValueError('invalid')", 'phase': 'validation', 'random_seed': None}
+    return {'validated': True}
@@ -1,11 +1,24 @@
+import logging
+import os
+import shutil
+import tempfile
 import unittest
+import transaction
 
 from pyramid import testing
 
+import json
 from json import loads
 
-from exercises_server.tests import init_testing_app, init_testing_db
-from exercises_server.models.support import DBSession
+import StringIO
+import zipfile
+from base64 import b64decode, b64encode
+from hashlib import sha1
+
+from exercises_server import cache, jobs, profiling, replicas, validation, views, warmup
+from exercises_server.tests import init_testing_app, init_testing_db, make_exercise_zip, add_exercise, fake_generate_instance_zip, fake_validate_exercise
+from exercises_server.models.support import DBSession, insert_ignoring_conflicts
+from exercises_server.models import Base, Blob, Exercise, ValidationResult, ExerciseInstance
 
 class APITests(unittest.TestCase):
     USER = 'exercises_server'
@@ -14,13 +27,29 @@ class APITests(unittest.TestCase):
     def setUp(self):
         self.app = init_testing_app()
         self.session = init_testing_db()
+        self._generate_instance_zip = views.generate_instance_zip
+        self._validate_exercise = validation.validate_exercise
+        self._warmup_generate_instance_zip = warmup.generate_instance_zip
+        views.generate_instance_zip = fake_generate_instance_zip
+        warmup.generate_instance_zip = fake_generate_instance_zip
+        validation.validate_exercise = fake_validate_exercise
 
 
     def tearDown(self):
+        views.generate_instance_zip = self._generate_instance_zip
+        validation.validate_exercise = self._validate_exercise
+        warmup.generate_instance_zip = self._warmup_generate_instance_zip
         DBSession.remove()
         testing.tearDown()
 
 
+    def get_json(self, url, params, status=None, headers=None):
+        """ GET with a JSON request body, like the exercises server expects. """
+        return self.app.request(
+            url, method='GET', body=json.dumps(params),
+            content_type='application/json', status=status, headers=headers)
+
+
     def create(self, user=USER, entry=PAYLOAD):
         res = self.app.post_json('/create', {'user': user, 'entry': entry})
         self.assertEquals(res.content_type, 'application/json')
@@ -52,3 +81,574 @@ class APITests(unittest.TestCase):
         res = self.app.get('/list')
         self.assertIsNotNone(res.headers.get('X-Request-Id'))
         self.assertEquals(res.headers['X-Request-Id'], res.json['request_id'])
+
+
+    def test_read_branches_and_versions(self):
+        static = make_exercise_zip()
+        template = make_exercise_zip(template=True)
+        add_exercise('exercise', '1', static, branches=['testing', 'published'])
+        add_exercise('exercise', '2', template, branches=['testing'])
+
+        res = self.get_json('/read', {'id': 'exercise'})
+        self.assertEquals(b64decode(res.json['exercise']), static)
+        res = self.get_json('/read', {'id': 'exercise', 'version': 'testing'})
+        self.assertEquals(b64decode(res.json['exercise']), template)
+        res = self.get_json('/read', {'id': 'exercise', 'version': '1'})
+        self.assertEquals(b64decode(res.json['exercise']), static)
+        res = self.get_json('/read', {'id': 'exercise', 'version': 'testing', 'random_seed': 5})
+        self.assertEquals(b64decode(res.json['exercise']), fake_generate_instance_zip(template, 5))
+
+        self.get_json('/read', {'id': 'exercise', 'random_seed': 5}, status=400)
+        self.get_json('/read', {'id': 'exercise', 'version': '3'}, status=404)
+        self.get_json('/read', {'id': 'missing'}, status=404)
+
+
+    def test_read_raw_zip(self):
+        template = make_exercise_zip(template=True)
+        add_exercise('exercise', '1', template, branches=['published'])
+
+        res = self.get_json('/read', {'id': 'exercise'}, headers={'Accept': 'application/zip'})
+        self.assertEquals(res.content_type, 'application/zip')
+        self.assertEquals(res.content_length, len(template))
+        self.assertEquals(res.body, template)
+
+        res = self.get_json('/read', {'id': 'exercise', 'random_seed': 1}, headers={'Accept': 'application/zip'})
+        self.assertEquals(res.body, fake_generate_instance_zip(template, 1))
+
+        res = self.get_json('/read', {'id': 'exercise'}, headers={'Accept': '*/*'})
+        self.assertEquals(res.content_type, 'application/json')
+
+
+    def test_read_etag(self):
+        add_exercise('exercise', '1', make_exercise_zip(), branches=['testing', 'published'])
+
+        res = self.get_json('/read', {'id': 'exercise'})
+        etag = res.headers['ETag']
+        self.get_json('/read', {'id': 'exercise'}, headers={'If-None-Match': etag}, status=304)
+        self.get_json('/read', {'id': 'exercise', 'version': '1'}, headers={'If-None-Match': etag}, status=304)
+        self.get_json('/read', {'id': 'exercise'}, headers={'If-None-Match': etag, 'Accept': 'application/zip'}, status=200)
+
+        add_exercise('exercise', '2', make_exercise_zip(template=True), branches=['published'])
+        self.get_json('/read', {'id': 'exercise'}, headers={'If-None-Match': etag}, status=200)
+
+
+    def test_list_etag(self):
+        add_exercise('exercise', '1', make_exercise_zip(), branches=['testing'])
+
+        res = self.get_json('/list', {'branch': 'published'})
+        etag = res.headers['ETag']
+        self.get_json('/list', {'branch': 'published'}, headers={'If-None-Match': etag}, status=304)
+        self.get_json('/list', {'branch': 'testing'}, headers={'If-None-Match': etag}, status=200)
+
+        self.app.put_json('/publish', {'id': 'exercise'})
+        res = self.get_json('/list', {'branch': 'published'}, headers={'If-None-Match': etag}, status=200)
+        self.assertEquals(res.json['exercises'], [{'id': 'exercise', 'version': '1'}])
+        etag = res.headers['ETag']
+
+        self.app.put_json('/retract', {'id': 'exercise'})
+        res = self.get_json('/list', {'branch': 'published'}, headers={'If-None-Match': etag}, status=200)
+        self.assertEquals(res.json['exercises'], [])
+
+
+    def test_changes(self):
+        add_exercise('exercise', '1', make_exercise_zip())
+        add_exercise('exercise', '2', make_exercise_zip())
+        cursor = self.get_json('/list', {'branch': 'published'}).json['cursor']
+
+        self.app.put_json('/publish', {'id': 'exercise', 'version': '1'})
+        self.app.put_json('/publish', {'id': 'exercise', 'version': '1'})
+        self.app.put_json('/publish', {'id': 'exercise', 'version': '2'})
+        self.app.put_json('/publish', {'id': 'exercise', 'version': '2', 'branch': 'testing'})
+        self.app.put_json('/retract', {'id': 'exercise'})
+
+        res = self.app.get('/changes', {'branch': 'published', 'since': cursor})
+        changes = [(c['id'], c['version'], c['change']) for c in res.json['changes']]
+        self.assertEquals(changes, [
+            ('exercise', '1', 'added'),
+            ('exercise', '2', 'moved'),
+            ('exercise', None, 'retracted')])
+        cursor = res.json['cursor']
+        self.assertEquals(cursor, res.json['changes'][-1]['seq'])
+
+        res = self.app.get('/changes', {'branch': 'published', 'since': cursor})
+        self.assertEquals(res.json['changes'], [])
+        self.assertEquals(res.json['cursor'], cursor)
+
+        res = self.app.get('/changes', {'branch': 'testing', 'limit': 1})
+        self.assertEquals(len(res.json['changes']), 1)
+        self.app.get('/changes', {'since': 'x'}, status=400)
+        for limit in [0, -1]:
+            self.app.get('/changes', {'limit': limit}, status=400)
+
+
+    def test_exercise_introspection(self):
+        static = make_exercise_zip(files={'image.png': 'PNG' * 100})
+        template = make_exercise_zip(template=True)
+        self.app.put('/update?id=static&version=1', static, content_type='application/zip')
+        self.app.put('/update?id=template&version=1', template, content_type='application/zip')
+        add_exercise('legacy', '1', template, branches=['testing'])
+
+        exercise = Exercise.get_by_id('static', '1')
+        self.assertFalse(exercise.is_template)
+        self.assertEquals(exercise.main_xml_hash, sha1(zipfile.ZipFile(StringIO.StringIO(static)).read('main.xml')).hexdigest())
+        self.assertEquals(sorted(exercise.members()), [('image.png', 300), ('main.xml', len(zipfile.ZipFile(StringIO.StringIO(static)).read('main.xml')))])
+        self.assertTrue(Exercise.get_by_id('template', '1').is_template)
+        self.assertIsNone(Exercise.get_by_id('legacy', '1').is_template)
+
+        # static exercises are rejected without generating an instance
+        calls = []
+        views.generate_instance_zip = lambda *args: calls.append(args)
+        res = self.get_json('/read', {'id': 'static', 'version': '1', 'random_seed': 1}, status=400)
+        self.assertEquals(res.json['error']['code'], 'ExerciseInvalid')
+        res = self.app.post_json('/read_batch', {'exercises': [{'id': 'static', 'version': '1', 'random_seed': 1}]})
+        self.assertEquals(res.json['exercises'][0]['error']['code'], 'ExerciseInvalid')
+        self.assertEquals(calls, [])
+
+        res = self.get_json('/list', {'branch': 'testing', 'type': 'template'})
+        self.assertEquals([e['id'] for e in res.json['exercises']], ['template'])
+        res = self.get_json('/list', {'branch': 'testing', 'type': 'static'}, headers={'Accept': 'application/x-ndjson'})
+        self.assertEquals([json.loads(line)['id'] for line in res.body.splitlines()], ['static'])
+        self.get_json('/list', {'type': 'other'}, status=400)
+
+
+    def test_list_pages(self):
+        for id in ['a', 'b', 'c', 'd', 'e']:
+            add_exercise(id, '1', make_exercise_zip(), branches=['published'])
+
+        res = self.get_json('/list', {'limit': 2})
+        self.assertEquals([e['id'] for e in res.json['exercises']], ['a', 'b'])
+        res = self.get_json('/list', {'limit': 2, 'after': res.json['next']})
+        self.assertEquals([e['id'] for e in res.json['exercises']], ['c', 'd'])
+        res = self.get_json('/list', {'limit': 2, 'after': res.json['next']})
+        self.assertEquals([e['id'] for e in res.json['exercises']], ['e'])
+        self.assertNotIn('next', res.json)
+
+        for limit in [0, -1, 'x']:
+            self.get_json('/list', {'limit': limit}, status=400)
+
+
+    def test_list_stream(self):
+        for id in ['a', 'b', 'c']:
+            add_exercise(id, '1', make_exercise_zip(), branches=['published'])
+
+        res = self.get_json('/list', {'after': 'a'}, headers={'Accept': 'application/x-ndjson'})
+        self.assertEquals(res.content_type, 'application/x-ndjson')
+        lines = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEquals(lines, [{'id': 'b', 'version': '1'}, {'id': 'c', 'version': '1'}])
+
+
+    def test_update(self):
+        image = 'PNG' * 1000
+        first = make_exercise_zip(files={'image.png': image})
+        second = make_exercise_zip(files={'image.png': image}, problem='What is 2 + 2?')
+
+        res = self.app.put_json('/update', {'id': 'exercise', 'version': '1', 'data_base64': b64encode(first)})
+        self.assertFalse(res.json['validation_cached'])
+        res = self.app.put_json('/update', {'id': 'exercise', 'version': '2', 'data_base64': b64encode(second)})
+        self.assertFalse(res.json['validation_cached'])
+        res = self.app.put_json('/update', {'id': 'exercise', 'version': '2', 'data_base64': b64encode(second)})
+        self.assertTrue(res.json['validation_cached'])
+
+        # the image is only stored once
+        self.assertEquals(self.session.query(Blob).count(), 3)
+
+        for version, data in [('1', first), ('2', second), ('testing', second)]:
+            res = self.get_json('/read', {'id': 'exercise', 'version': version})
+            zipArchive = zipfile.ZipFile(StringIO.StringIO(b64decode(res.json['exercise'])))
+            self.assertEquals(zipArchive.read('image.png'), image)
+            self.assertEquals(zipArchive.read('main.xml'), zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml'))
+
+
+    def test_update_raw(self):
+        data = make_exercise_zip()
+        res = self.app.put('/update?id=exercise&version=1', data, content_type='application/zip')
+        self.assertFalse(res.json['validation_cached'])
+        res = self.app.put('/update', data, content_type='application/zip',
+                           headers={'X-Exercise-Id': 'exercise', 'X-Exercise-Version': '2'})
+        self.assertTrue(res.json['validation_cached'])
+        res = self.get_json('/read', {'id': 'exercise', 'version': 'testing'})
+        zipArchive = zipfile.ZipFile(StringIO.StringIO(b64decode(res.json['exercise'])))
+        self.assertEquals(zipArchive.read('main.xml'), zipfile.ZipFile(StringIO.StringIO(data)).read('main.xml'))
+
+        res = self.app.put('/update?id=exercise', data, content_type='application/zip', status=400)
+        self.assertEquals(res.json['error']['code'], 'BadRequest')
+
+        self.app.app.registry.settings['update.max_bytes'] = len(data) - 1
+        try:
+            res = self.app.put('/update?id=exercise&version=3', data, content_type='application/zip', status=413)
+            self.assertEquals(res.json['error']['code'], 'RequestTooLarge')
+            self.app.put_json('/update', {'id': 'exercise', 'version': '3', 'data_base64': b64encode(data)}, status=413)
+        finally:
+            del self.app.app.registry.settings['update.max_bytes']
+
+
+    def test_update_existing_version(self):
+        first = make_exercise_zip(template=True)
+        second = make_exercise_zip(template=True, problem='What is 2 + 2?')
+        self.app.put('/update?id=exercise&version=1', first, content_type='application/zip')
+        res = self.get_json('/read', {'id': 'exercise', 'version': '1', 'random_seed': 1})
+        instance = res.json['exercise']
+
+        # the same members can be put again, but not different ones
+        self.app.put_json('/update', {'id': 'exercise', 'version': '1', 'data_base64': b64encode(first)})
+        res = self.app.put('/update?id=exercise&version=1', second, content_type='application/zip', status=409)
+        self.assertEquals(res.json['error']['code'], 'ExerciseConflict')
+        self.assertEquals(self.get_json('/read', {'id': 'exercise', 'version': '1', 'random_seed': 1}).json['exercise'], instance)
+
+        res = self.app.put_json('/update_batch', {'exercises': [
+            {'id': 'exercise', 'version': '1', 'data_base64': b64encode(second)},
+            {'id': 'exercise', 'version': '2', 'data_base64': b64encode(second)},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(results[0]['error']['code'], 'ExerciseConflict')
+        self.assertEquals(results[1]['result'], 'success')
+        self.assertEquals(self.get_json('/list', {'branch': 'testing'}).json['exercises'], [{'id': 'exercise', 'version': '2'}])
+
+
+    def test_store_existing_blobs(self):
+        # as if another request stored the blob after this one checked
+        row = {'hash': 'a' * 40, 'size': 1, 'crc': 0, 'compress_type': 0, 'data': 'x'}
+        insert_ignoring_conflicts(Blob.__table__, [row])
+        insert_ignoring_conflicts(Blob.__table__, [row])
+        transaction.commit()
+        self.assertEquals(self.session.query(Blob).count(), 1)
+
+
+    def test_get_data_evicted_after_prefetch(self):
+        Exercise.store('exercise', '1', make_exercise_zip(files={'image.png': 'PNG' * 100}))
+        transaction.commit()
+        exercise = Exercise.get_by_id('exercise', '1')
+        data = exercise.get_data()
+        # the zip was cached when the blobs were prefetched, then evicted
+        blobs = Exercise.prefetch_blobs([exercise])
+        self.assertEquals(blobs, {})
+        cache.setup_instance_cache({})
+        self.assertEquals(exercise.get_data(blobs), data)
+
+
+    def test_record_existing_validation_result(self):
+        # as if a concurrent upload of the same zip recorded it first
+        ValidationResult.record('a' * 40, '1', {'validated': True})
+        ValidationResult.record('a' * 40, '1', {'validated': True})
+        transaction.commit()
+        self.assertEquals(ValidationResult.lookup('a' * 40, '1'), {'validated': True})
+        self.assertEquals(self.session.query(ValidationResult).count(), 1)
+
+
+    def test_update_invalid(self):
+        data = make_exercise_zip(problem='invalid')
+        for i in range(2):
+            res = self.app.put_json('/update', {'id': 'exercise', 'version': '1', 'data_base64': b64encode(data)}, status=400)
+            self.assertEquals(res.json['error']['code'], 'ExerciseInvalid')
+            self.assertFalse(res.json['error']['validation_result']['validated'])
+        self.assertEquals(self.session.query(ValidationResult).count(), 1)
+
+
+    def test_update_async(self):
+        res = self.app.put_json('/update?async=1', {'id': 'a', 'version': '1', 'data_base64': b64encode(make_exercise_zip())}, status=202)
+        validJobId = res.json['job_id']
+        res = self.app.put_json('/update?async=1', {'id': 'b', 'version': '1', 'data_base64': b64encode(make_exercise_zip(problem='invalid'))}, status=202)
+        invalidJobId = res.json['job_id']
+
+        job = self.app.get('/jobs/%s' % invalidJobId).json['job']
+        self.assertEquals(job['status'], 'queued')
+        self.assertEquals(job['queue_position'], 1)
+        self.get_json('/read', {'id': 'a', 'version': 'testing'}, status=404)
+
+        self.assertEquals(jobs.run_pending_jobs(), 2)
+
+        job = self.app.get('/jobs/%s' % validJobId).json['job']
+        self.assertEquals(job['status'], 'succeeded')
+        self.assertTrue(job['result']['validated'])
+        self.get_json('/read', {'id': 'a', 'version': 'testing'})
+
+        job = self.app.get('/jobs/%s' % invalidJobId).json['job']
+        self.assertEquals(job['status'], 'failed')
+        self.assertFalse(job['result']['validation_result']['validated'])
+        self.get_json('/read', {'id': 'b', 'version': 'testing'}, status=404)
+
+        self.app.get('/jobs/%d' % (invalidJobId + 1), status=404)
+
+
+    def test_job_runner_starts_per_process(self):
+        started = []
+        class FakeRunner(object):
+            def __init__(self, *args):
+                pass
+            def start(self):
+                started.append(os.getpid())
+        self.app = init_testing_app(**{'jobs.runner': 'true'})
+        JobRunner = jobs.JobRunner
+        jobs.JobRunner = FakeRunner
+        try:
+            self.assertEquals(started, [])
+            self.app.get('/health')
+            self.app.get('/health')
+            self.assertEquals(started, [os.getpid()])
+        finally:
+            jobs.JobRunner = JobRunner
+            jobs._runnerArgs = jobs._runnerPid = None
+
+
+    def test_update_batch(self):
+        valid = make_exercise_zip()
+        invalid = make_exercise_zip(problem='invalid')
+
+        res = self.app.put_json('/update_batch', {'exercises': [
+            {'id': 'a', 'version': '1', 'data_base64': b64encode(valid)},
+            {'id': 'b', 'version': '1', 'data_base64': b64encode(invalid)},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(results[0]['result'], 'success')
+        self.assertEquals(results[1]['error']['code'], 'ExerciseInvalid')
+        self.assertFalse(results[1]['error']['validation_result']['validated'])
+
+        self.get_json('/read', {'id': 'a', 'version': 'testing'})
+        self.get_json('/read', {'id': 'b', 'version': 'testing'}, status=404)
+
+        # the same again, as multipart/form-data
+        res = self.app.put('/update_batch',
+            [('id', 'a'), ('version', '2'), ('id', 'b'), ('version', '2')],
+            upload_files=[('data', 'a.zip', valid), ('data', 'b.zip', invalid)])
+        results = res.json['exercises']
+        self.assertEquals(results[0]['result'], 'success')
+        self.assertTrue(results[0]['validation_cached'])
+        self.assertEquals(results[1]['error']['code'], 'ExerciseInvalid')
+
+        res = self.get_json('/read', {'id': 'a', 'version': 'testing'})
+        self.assertEquals(
+            zipfile.ZipFile(StringIO.StringIO(b64decode(res.json['exercise']))).read('main.xml'),
+            zipfile.ZipFile(StringIO.StringIO(valid)).read('main.xml'))
+
+
+    def test_update_batch_too_large(self):
+        self.app = init_testing_app(**{'update.max_bytes': '1000'})
+        res = self.app.put_json('/update_batch', {'exercises': [
+            {'id': 'a', 'version': '1', 'data_base64': b64encode(make_exercise_zip(files={'big.txt': os.urandom(2000)}))},
+            {'id': 'b', 'version': '1', 'data_base64': b64encode(make_exercise_zip())},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(results[0]['error']['status'], 413)
+        self.assertEquals(results[0]['error']['code'], 'RequestTooLarge')
+        self.assertEquals(results[1]['result'], 'success')
+        self.get_json('/read', {'id': 'a', 'version': 'testing'}, status=404)
+
+
+    def test_update_batch_task_error(self):
+        res = self.app.put_json('/update_batch', {'exercises': [
+            {'id': 'a', 'version': '1', 'data_base64': b64encode(make_exercise_zip(problem='broken'))},
+            {'id': 'b', 'version': '1', 'data_base64': b64encode(make_exercise_zip())},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(results[0]['error']['status'], 500)
+        self.assertEquals(results[0]['error']['code'], 'RuntimeError')
+        self.assertEquals(results[1]['result'], 'success')
+        self.get_json('/read', {'id': 'a', 'version': 'testing'}, status=404)
+        self.get_json('/read', {'id': 'b', 'version': 'testing'})
+
+
+    def test_publish(self):
+        add_exercise('exercise', '1', make_exercise_zip(), branches=['testing'])
+        self.get_json('/read', {'id': 'exercise'}, status=404)
+
+        self.app.put_json('/publish', {'id': 'exercise'})
+        self.get_json('/read', {'id': 'exercise'})
+
+        self.app.put_json('/publish', {'id': 'exercise', 'version': '2'}, status=404)
+
+
+    def test_publish_warmup(self):
+        template = make_exercise_zip(template=True)
+        add_exercise('template', '1', template, branches=['testing'])
+        add_exercise('static', '1', make_exercise_zip(), branches=['testing'])
+        self.app.put_json('/publish', {'id': 'template'})
+        self.app.put_json('/publish', {'id': 'static'})
+        self.assertEquals(jobs.run_pending_jobs(), 2)
+        self.assertEquals(ExerciseInstance.get_seeds('template', '1'), set([1, 2, 3]))
+        self.assertEquals(ExerciseInstance.get_seeds('static', '1'), set())
+
+        # stored instances are served without generating them
+        def generate_instance_zip(data, random_seed):
+            raise AssertionError("instance should have been pre-generated")
+        views.generate_instance_zip = generate_instance_zip
+        res = self.get_json('/read', {'id': 'template', 'random_seed': 2})
+        self.assertEquals(b64decode(res.json['exercise']), fake_generate_instance_zip(template, 2))
+
+
+    def test_stored_instances(self):
+        template = make_exercise_zip(template=True)
+        add_exercise('template', '1', template, branches=['published'])
+        for seed in [4, 5, 6]:
+            self.get_json('/read', {'id': 'template', 'random_seed': seed})
+        instance = ExerciseInstance.get('template', '1', 5)
+        self.assertEquals(instance.data, fake_generate_instance_zip(template, 5))
+        self.assertEquals(instance.size, len(instance.data))
+        self.assertIsNotNone(instance.generation_time)
+
+        # least recently read first
+        instance = ExerciseInstance.get('template', '1', 4)
+        instance.last_accessed -= ExerciseInstance.ACCESS_RESOLUTION
+        self.assertEquals(ExerciseInstance.evict(2 * instance.size), 1)
+        self.assertEquals(ExerciseInstance.get_seeds('template', '1'), set([5, 6]))
+        transaction.commit()
+
+        cache.instance_cache.clear()
+        res = self.app.post_json('/read_batch', {'exercises': [{'id': 'template', 'random_seed': 6}]})
+        self.assertEquals(b64decode(res.json['exercises'][0]['exercise']), fake_generate_instance_zip(template, 6))
+
+        self.assertEquals(ExerciseInstance.purge('template'), 2)
+
+
+    def test_metrics(self):
+        add_exercise('exercise', '1', make_exercise_zip(), branches=['published'])
+        self.get_json('/read', {'id': 'exercise'})
+        res = self.app.get('/metrics')
+        self.assertEquals(res.content_type, 'text/plain')
+        self.assertIn('exercises_requests_total{route="read",status="200"}', res.text)
+        self.assertIn('exercises_phase_duration_seconds_count{phase="db_lookup"}', res.text)
+
+
+    def test_profiling(self):
+        profileDir = tempfile.mkdtemp()
+        try:
+            self.app = init_testing_app(**{'profiling.enabled': 'true', 'profiling.dir': profileDir, 'profiling.secret': 'secret'})
+            self.session = init_testing_db()
+            add_exercise('exercise', '1', make_exercise_zip(), branches=['published'])
+            self.get_json('/read', {'id': 'exercise'})
+            self.app.get('/admin/profiles/%s' % self.get_json('/read', {'id': 'exercise'}).json['request_id'], status=404)
+            # the header is ignored without the secret
+            self.app.get('/admin/profiles/%s' % self.get_json('/read', {'id': 'exercise'}, headers={'X-Profile': '1'}).json['request_id'], status=404)
+
+            requestId = self.get_json('/read', {'id': 'exercise'}, headers={'X-Profile': 'secret'}).json['request_id']
+            profiles = self.app.get('/admin/profiles').json['profiles']
+            self.assertEquals([profile['request_id'] for profile in profiles], [requestId])
+            self.assertEquals(profiles[0]['route'], 'read')
+
+            res = self.app.get('/admin/profiles/%s' % requestId)
+            self.assertEquals(res.content_type, 'application/octet-stream')
+            res = self.app.get('/admin/profiles/%s?format=text' % requestId)
+            self.assertIn('read_view', res.text)
+        finally:
+            profiling.enabled = False
+            profiling.secret = None
+            shutil.rmtree(profileDir)
+
+
+    def test_slow_log(self):
+        self.app = init_testing_app(**{'slow_log.threshold': '0.000001'})
+        self.session = init_testing_db()
+        add_exercise('template', '1', make_exercise_zip(template=True), branches=['published'])
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logging.getLogger('exercises_server.slowlog').addHandler(handler)
+        try:
+            requestId = self.get_json('/read', {'id': 'template', 'random_seed': 7}).json['request_id']
+            # large bodies aren't decoded again for their params
+            upload = make_exercise_zip(files={'image.png': os.urandom(100000)})
+            self.app.put_json('/update', {'id': 'upload', 'version': '1', 'data_base64': b64encode(upload)})
+        finally:
+            logging.getLogger('exercises_server.slowlog').removeHandler(handler)
+
+        self.assertEquals(len(records), 2)
+        info = loads(records.pop().getMessage().split(' <> ', 1)[1])
+        self.assertEquals(info['route'], 'update')
+        self.assertNotIn('id', info)
+
+        self.assertEquals(len(records), 1)
+        info = loads(records[0].getMessage().split(' <> ', 1)[1])
+        self.assertEquals(info['request_id'], requestId)
+        self.assertEquals((info['route'], info['id'], info['random_seed']), ('read', 'template', 7))
+        self.assertIn('db_lookup', info['phases'])
+        self.assertTrue(info['query_count'] > 0)
+        self.assertIn('SELECT', info['queries'][0]['statement'])
+
+
+    def test_health(self):
+        self.assertEquals(self.app.get('/health').json['status'], 'ok')
+        self.assertEquals(self.app.get('/admin/pool').json['pool']['class'], 'SingletonThreadPool')
+
+
+    def test_replicas(self):
+        self.app = init_testing_app(**{'replicas.urls': 'sqlite://'})
+        self.session = init_testing_db()
+        Base.metadata.create_all(replicas.replicas[0])
+        add_exercise('exercise', '1', make_exercise_zip(), branches=['testing'])
+
+        # the replica hasn't caught up
+        self.get_json('/read', {'id': 'exercise', 'version': 'testing'}, status=404)
+        self.assertEquals(self.get_json('/list', {'branch': 'testing'}).json['exercises'], [])
+
+        # but the client reads its own writes from the primary
+        res = self.app.put_json('/publish', {'id': 'exercise'})
+        self.assertIn(replicas.COOKIE_NAME, res.headers['Set-Cookie'])
+        self.get_json('/read', {'id': 'exercise'})
+        self.assertEquals(len(self.get_json('/list', {'branch': 'testing'}).json['exercises']), 1)
+
+        self.app.reset()
+        self.get_json('/read', {'id': 'exercise'}, status=404)
+
+
+    def test_read_batch(self):
+        static = make_exercise_zip()
+        template = make_exercise_zip(template=True)
+        add_exercise('static', '1', static, branches=['testing', 'published'])
+        add_exercise('template', '1', template, branches=['testing'])
+        add_exercise('template', '2', template)
+
+        res = self.app.post_json('/read_batch', {'exercises': [
+            {'id': 'static'},
+            {'id': 'template', 'version': 'testing', 'random_seed': 3},
+            {'id': 'template', 'version': '2'},
+            {'id': 'template'},
+            {'id': 'static', 'random_seed': 3},
+            {'id': 'missing', 'version': '1'},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(len(results), 6)
+        self.assertEquals(b64decode(results[0]['exercise']), static)
+        self.assertEquals(b64decode(results[1]['exercise']), fake_generate_instance_zip(template, 3))
+        self.assertEquals(b64decode(results[2]['exercise']), template)
+        self.assertEquals(results[3]['error']['status'], 404)
+        self.assertEquals(results[4]['error']['code'], 'ExerciseInvalid')
+        self.assertEquals(results[5]['error']['status'], 404)
+
+
+    def test_read_batch_stored_instances(self):
+        Exercise.store('template', '1', make_exercise_zip(template=True, files={'image.png': 'PNG' * 100}))
+        transaction.commit()
+        self.app.put_json('/publish', {'id': 'template', 'version': '1'})
+        items = [{'id': 'template', 'random_seed': seed} for seed in [1, 2]]
+        expected = self.app.post_json('/read_batch', {'exercises': items}).json['exercises']
+
+        # served from the stored instances without loading the zip
+        cache.setup_instance_cache({})
+        getMany = Blob.get_many
+        fetched = []
+        Blob.get_many = classmethod(lambda cls, hashes: fetched.extend(hashes) or getMany(hashes))
+        try:
+            res = self.app.post_json('/read_batch', {'exercises': items})
+        finally:
+            Blob.get_many = getMany
+        self.assertEquals(res.json['exercises'], expected)
+        self.assertEquals(fetched, [])
+
+
+    def test_read_batch_task_error(self):
+        template = make_exercise_zip(template=True)
+        add_exercise('template', '1', template, branches=['testing'])
+        add_exercise('broken', '1', make_exercise_zip(template=True, problem='broken'), branches=['testing'])
+
+        res = self.app.post_json('/read_batch', {'exercises': [
+            {'id': 'broken', 'version': 'testing', 'random_seed': 1},
+            {'id': 'template', 'version': 'testing', 'random_seed': 1},
+        ]})
+        results = res.json['exercises']
+        self.assertEquals(results[0]['error']['status'], 500)
+        self.assertEquals(results[0]['error']['code'], 'RuntimeError')
+        self.assertEquals(b64decode(results[1]['exercise']), fake_generate_instance_zip(template, 1))
+
+
+    def test_read_batch_bad_request(self):
+        self.app.post_json('/read_batch', {'exercises': [{'version': '1'}]}, status=400)
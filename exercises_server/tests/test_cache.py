@@ -0,0 +1,43 @@
+import unittest
+
+from exercises_server.cache import InstanceCache
+
+
+class TestInstanceCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = InstanceCache(max_items=10, max_bytes=100)
+        self.assertIsNone(cache.get(('a', '1', 1)))
+        cache.put(('a', '1', 1), 'zipdata')
+        self.assertEquals(cache.get(('a', '1', 1)), 'zipdata')
+        self.assertEquals(cache.hits, 1)
+        self.assertEquals(cache.misses, 1)
+
+
+    def test_evicts_least_recently_used_item(self):
+        cache = InstanceCache(max_items=2, max_bytes=100)
+        cache.put('a', 'x')
+        cache.put('b', 'y')
+        cache.get('a')
+        cache.put('c', 'z')
+        self.assertEquals(cache.get('a'), 'x')
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals(cache.evictions, 1)
+
+
+    def test_evicts_by_size(self):
+        cache = InstanceCache(max_items=10, max_bytes=10)
+        cache.put('a', '123456')
+        cache.put('b', '123456')
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(cache.size, 6)
+
+        # too big to cache at all
+        cache.put('c', '12345678901')
+        self.assertIsNone(cache.get('c'))
+        self.assertEquals(len(cache), 1)
+
+
+    def test_disabled(self):
+        cache = InstanceCache(max_items=0, max_bytes=0)
+        cache.put('a', 'x')
+        self.assertIsNone(cache.get('a'))
@@ -0,0 +1,41 @@
+import unittest
+
+from sqlalchemy import create_engine, exc
+
+from exercises_server.dbpool import TimedQueuePool, make_engine, pool_stats
+
+
+class TestTimedQueuePool(unittest.TestCase):
+    def test_stats(self):
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1)
+        connection = engine.connect()
+        stats = pool_stats(engine)
+        self.assertEquals((stats['class'], stats['checked_out'], stats['checkouts']), ('TimedQueuePool', 1, 1))
+
+        self.assertRaises(exc.TimeoutError, engine.connect)
+        stats = pool_stats(engine)
+        self.assertEquals((stats['checkouts'], stats['timeouts']), (2, 1))
+        self.assertTrue(stats['wait_max'] >= 0.1)
+        connection.close()
+        self.assertEquals(pool_stats(engine)['checked_in'], 1)
+
+
+    def test_make_engine(self):
+        engine = make_engine({'sqlalchemy.url': 'sqlite://', 'sqlalchemy.pool_pre_ping': 'false'})
+        self.assertFalse(engine.pool._pre_ping)
+        self.assertEquals(engine.execute('SELECT 1').scalar(), 1)
+
+
+    def test_connections_from_other_processes_are_replaced(self):
+        engine = make_engine({'sqlalchemy.url': 'sqlite://'})
+        connection = engine.connect()
+        dbapiConnection = connection.connection.connection
+        record = connection.connection._connection_record
+        connection.close()
+
+        # as if the connection had been opened before a fork
+        record.info['pid'] = -1
+        connection = engine.connect()
+        self.assertIsNot(connection.connection.connection, dbapiConnection)
+        self.assertEquals(connection.execute('SELECT 1').scalar(), 1)
+        connection.close()
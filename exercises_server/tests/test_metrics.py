@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from exercises_server import metrics
+from exercises_server.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        registry.inc('exercises_requests_total', {'route': 'read', 'status': '200'})
+        registry.inc('exercises_requests_total', {'route': 'read', 'status': '200'})
+        registry.observe('exercises_phase_duration_seconds', {'phase': 'base64'}, 0.02)
+        registry.observe('exercises_phase_duration_seconds', {'phase': 'base64'}, 100)
+        lines = registry.render().splitlines()
+        self.assertIn('exercises_requests_total{route="read",status="200"} 2', lines)
+        self.assertIn('exercises_phase_duration_seconds_bucket{phase="base64",le="0.01"} 0', lines)
+        self.assertIn('exercises_phase_duration_seconds_bucket{phase="base64",le="0.025"} 1', lines)
+        self.assertIn('exercises_phase_duration_seconds_bucket{phase="base64",le="60.0"} 1', lines)
+        self.assertIn('exercises_phase_duration_seconds_bucket{phase="base64",le="+Inf"} 2', lines)
+        self.assertIn('exercises_phase_duration_seconds_count{phase="base64"} 2', lines)
+
+
+    def test_collect(self):
+        metricsDir = tempfile.mkdtemp()
+        try:
+            metrics.setup_metrics({'metrics.dir': metricsDir})
+            metrics.registry = Registry()
+            other = Registry()
+            other.inc('exercises_requests_total', {'route': 'list', 'status': '200'}, 3)
+            # a running process (our parent)
+            with open(os.path.join(metricsDir, '%d-1.json' % os.getppid()), 'w') as f:
+                json.dump(other.snapshot(), f)
+
+            metrics.get_registry().inc('exercises_requests_total', {'route': 'list', 'status': '200'}, 2)
+            metrics.flush(force=True)
+            self.assertTrue(os.path.exists(os.path.join(metricsDir, metrics._process_file())))
+            self.assertIn('exercises_requests_total{route="list",status="200"} 5', metrics.collect().render().splitlines())
+        finally:
+            metrics.setup_metrics({})
+            metrics.registry = Registry()
+            shutil.rmtree(metricsDir)
+
+
+    def test_collect_exited(self):
+        metricsDir = tempfile.mkdtemp()
+        try:
+            metrics.setup_metrics({'metrics.dir': metricsDir})
+            metrics.registry = Registry()
+            other = Registry()
+            other.inc('exercises_requests_total', {'route': 'list', 'status': '200'}, 3)
+            # a process that has exited, an earlier process with our
+            # parent's pid, and one folded before a crash
+            exitedPid = os.fork()
+            if exitedPid == 0:
+                os._exit(0)
+            os.waitpid(exitedPid, 0)
+            for filename in ['%d-1.json' % exitedPid, '%d-1.json' % os.getppid(), '%d-2.json' % os.getppid(), '%d-3.json' % exitedPid]:
+                with open(os.path.join(metricsDir, filename), 'w') as f:
+                    json.dump(other.snapshot(), f)
+            with open(os.path.join(metricsDir, metrics.EXITED_FILE), 'w') as f:
+                json.dump(dict(Registry().snapshot(), folded=['%d-3.json' % exitedPid]), f)
+
+            for i in range(2):
+                self.assertIn('exercises_requests_total{route="list",status="200"} 9', metrics.collect().render().splitlines())
+                self.assertEquals(sorted(os.listdir(metricsDir)), sorted(['.lock', metrics.EXITED_FILE, '%d-2.json' % os.getppid()]))
+        finally:
+            metrics.setup_metrics({})
+            metrics.registry = Registry()
+            shutil.rmtree(metricsDir)
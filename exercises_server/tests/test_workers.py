@@ -0,0 +1,74 @@
+import os
+import time
+import unittest
+
+from exercises_server.workers import WorkerPool, QueueFull, TaskError, TaskTimeout, background, profiled
+
+
+class UnpicklableError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+
+
+def raise_unpicklable():
+    raise UnpicklableError(1, 'cannot be rebuilt from its args')
+
+
+class TestWorkerPool(unittest.TestCase):
+    def tearDown(self):
+        if hasattr(self, 'pool'):
+            self.pool.close()
+
+
+    def test_inline(self):
+        self.pool = WorkerPool(processes=0)
+        self.assertEquals(self.pool.submit(pow, 2, 10), 1024)
+        self.assertRaises(ZeroDivisionError, self.pool.submit, divmod, 1, 0)
+
+
+    def test_processes(self):
+        self.pool = WorkerPool(processes=2, timeout=10)
+        self.assertEquals(self.pool.submit(pow, 2, 10), 1024)
+        self.assertRaises(ZeroDivisionError, self.pool.submit, divmod, 1, 0)
+
+
+    def test_unpicklable_error(self):
+        self.pool = WorkerPool(processes=1, timeout=10, max_queue=1)
+        for i in range(2):
+            self.assertRaises(TaskError, self.pool.submit, raise_unpicklable)
+        self.assertEquals(self.pool.submit(pow, 2, 10), 1024)
+        self.assertEquals(self.pool.pending, 0)
+
+
+    def test_timeout(self):
+        self.pool = WorkerPool(processes=1, timeout=0.1)
+        self.assertRaises(TaskTimeout, self.pool.submit, time.sleep, 1)
+
+
+    def test_queue_full(self):
+        self.pool = WorkerPool(processes=1, timeout=10, max_queue=1)
+        handle = self.pool.apply_async(time.sleep, 0.5)
+        self.assertRaises(QueueFull, self.pool.submit, pow, 2, 10)
+        self.pool.result(handle)
+        self.assertEquals(self.pool.submit(pow, 2, 10), 1024)
+
+
+    def test_profiled(self):
+        self.pool = WorkerPool(processes=1, timeout=0.1, max_queue=1)
+        with profiled() as stats:
+            self.assertNotEquals(self.pool.submit(os.getpid), os.getpid())
+            # still under the pool limits
+            self.assertRaises(TaskTimeout, self.pool.submit, time.sleep, 1)
+        self.assertEquals(len(stats), 1)
+        self.assertIn('getpid', repr(stats[0].keys()))
+
+
+    def test_background(self):
+        self.pool = WorkerPool(processes=1, timeout=0.1, max_queue=1)
+        handle = self.pool.apply_async(time.sleep, 0.3)
+        with background(timeout=10):
+            # waits for the queue to have room, then for longer than
+            # the pool timeout
+            self.assertEquals(self.pool.submit(time.sleep, 0.3), None)
+        with background(timeout=0.1):
+            self.assertRaises(TaskTimeout, self.pool.submit, time.sleep, 1)
@@ -0,0 +1,46 @@
+import os
+import StringIO
+import unittest
+import zipfile
+
+from exercises_server.zips import read_members, build_zip, build_instance_zip, read_raw
+from exercises_server.tests import make_exercise_zip
+
+
+class TestZips(unittest.TestCase):
+    def test_rebuild(self):
+        data = make_exercise_zip(files={'a.png': 'PNG' * 100, 'b.txt': ''})
+        members = read_members(data)
+        self.assertEquals([member.name for member in members], ['main.xml', 'a.png', 'b.txt'])
+        self.assertEquals(members[1].size, 300)
+
+        rebuilt = zipfile.ZipFile(StringIO.StringIO(build_zip(members)))
+        self.assertIsNone(rebuilt.testzip())
+        original = zipfile.ZipFile(StringIO.StringIO(data))
+        for name in original.namelist():
+            self.assertEquals(rebuilt.read(name), original.read(name))
+
+
+    def test_rebuild_is_deterministic(self):
+        members = read_members(make_exercise_zip())
+        self.assertEquals(build_zip(members), build_zip(read_members(build_zip(members))))
+
+
+    def test_build_instance_zip(self):
+        figure = 'SVG' * 1000
+        template = make_exercise_zip(template=True, files={'figure.svg': figure, 'old.png': 'PNG'})
+        image = os.urandom(1000)
+        data = build_instance_zip(template, '<exercise/>', {'figure.svg': figure, 'new.png': image, 'new.svg': 'SVG' * 100})
+
+        instance = zipfile.ZipFile(StringIO.StringIO(data))
+        self.assertIsNone(instance.testzip())
+        self.assertEquals(sorted(instance.namelist()), ['figure.svg', 'main.xml', 'new.png', 'new.svg'])
+        self.assertEquals(instance.read('main.xml'), '<exercise/>')
+        self.assertEquals(instance.read('new.png'), image)
+
+        # unchanged members are copied from the template as they are
+        templateZip = zipfile.ZipFile(StringIO.StringIO(template))
+        self.assertEquals(read_raw(instance, instance.getinfo('figure.svg')), read_raw(templateZip, templateZip.getinfo('figure.svg')))
+        # and already-compressed formats are not compressed again
+        self.assertEquals(instance.getinfo('new.png').compress_type, zipfile.ZIP_STORED)
+        self.assertEquals(instance.getinfo('new.svg').compress_type, zipfile.ZIP_DEFLATED)
@@ -59,3 +59,40 @@ def parse_json_body(json_body, required_keys=[], optional_keys=[], defaults={}):
     params = dict(defaults)
     params.update(json_body)
     return params
+
+
+def make_etag(*parts):
+    """
+    Return a strong entity tag for a response that is fully
+    determined by +parts+.
+    """
+    from hashlib import sha1
+    return sha1(repr(parts)).hexdigest()
+
+
+def read_body(request, max_bytes, chunk_size=65536):
+    """
+    Read the body of +request+ in +chunk_size+ chunks, hashing it as
+    it is read, without buffering it in the request. Returns the
+    (data, SHA-1 hex digest) pair, or raises RequestTooLarge if the
+    body is longer than +max_bytes+.
+    """
+    from hashlib import sha1
+    from errors import RequestTooLarge
+
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise RequestTooLarge("Request body of %d bytes is larger than %d bytes" % (request.content_length, max_bytes))
+
+    contentHash = sha1()
+    chunks = []
+    size = 0
+    while True:
+        chunk = request.body_file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise RequestTooLarge("Request body is larger than %d bytes" % max_bytes)
+        contentHash.update(chunk)
+        chunks.append(chunk)
+    return ''.join(chunks), contentHash.hexdigest()
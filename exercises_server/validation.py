@@ -0,0 +1,72 @@
+'''
+Exercise validation, with results cached in the database by content
+hash and validator version.
+'''
+from hashlib import sha1
+
+from exercises_server import workers
+from exercises_server.instances import validate_exercise, validator_version
+from exercises_server.models import ValidationResult
+
+import logging
+log = logging.getLogger(__name__)
+
+
+_validatorVersion = None
+
+
+def setup_validation(settings):
+    '''
+    Determine the validator version used to key cached results. It
+    can be set with validation.validator_version; if it is neither set
+    nor detectable, results are not cached.
+    '''
+    global _validatorVersion
+    _validatorVersion = settings.get('validation.validator_version') or validator_version()
+    if _validatorVersion is None:
+        log.warning("Validator version unknown, validation results will not be cached")
+
+
+def content_hash(data):
+    return sha1(data).hexdigest()
+
+
+def validate(data, contentHash=None):
+    '''
+    Validate the exercise zip +data+, whose SHA-1 hex digest is
+    +contentHash+ if already known. Returns a (result, cached) pair of
+    the validation result dict and whether it came from the cache.
+    '''
+    if _validatorVersion is not None:
+        contentHash = contentHash or content_hash(data)
+        result = ValidationResult.lookup(contentHash, _validatorVersion)
+        if result is not None:
+            return result, True
+
+    result = workers.pool.submit(validate_exercise, data)
+
+    if _validatorVersion is not None:
+        ValidationResult.record(contentHash, _validatorVersion, result)
+    return result, False
+
+
+def validate_many(datas):
+    '''
+    Validate each of the exercise zips in +datas+, running the
+    validations that aren't cached concurrently in the worker pool.
+    Returns a list of (result, cached) pairs, in order, where result
+    is the exception if validation timed out or failed.
+    '''
+    hashes = [content_hash(data) for data in datas]
+    results = [None] * len(datas)
+    if _validatorVersion is not None:
+        found = ValidationResult.lookup_many(hashes, _validatorVersion)
+        results = [(found[contentHash], True) if contentHash in found else None for contentHash in hashes]
+
+    uncached = [i for i, result in enumerate(results) if result is None]
+    validated = workers.pool.map(validate_exercise, [(datas[i],) for i in uncached])
+    for i, (success, value) in zip(uncached, validated):
+        results[i] = (value, False)
+        if success and _validatorVersion is not None:
+            ValidationResult.record(hashes[i], _validatorVersion, value)
+    return results
@@ -1,31 +1,73 @@
-from pyramid.response import Response
+from pyramid.response import Response, FileResponse
 from pyramid.exceptions import NotFound
-from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotModified
 from pyramid.view import view_config
 
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm.attributes import instance_dict
 import transaction
 
+import json
+import os
+import StringIO
+
 import logging
 log = logging.getLogger(__name__)
 
 from .models import (
     DBSession,
+    StreamSession,
     Exercise,
     CurrentVersion,
+    BranchRevision,
+    BranchChange,
+    Job,
+    ExerciseInstance,
+    VersionConflict,
     )
 
-from exercises_server.errors import ExerciseInvalid, BadRequest
+from exercises_server import cache, metrics, profiling, replicas, validation, warmup, workers
+from exercises_server.dbpool import pool_stats
+from exercises_server.errors import ExerciseInvalid, ExerciseConflict, BadRequest, RequestTooLarge, ServerBusy, TaskTimeout, item_error
+from exercises_server.instances import generate_instance_zip, NotATemplate
 from exercises_server.requests import log_request
-from exercises_server.utils import parse_iso8601, parse_json_body
+from exercises_server.utils import parse_iso8601, parse_json_body, make_etag, read_body
+
+
+def accepts_zip(request):
+    '''
+    Return whether the client prefers a raw application/zip response
+    over the default JSON one.
+    '''
+    return request.accept.best_match(['application/json', 'application/zip']) == 'application/zip'
+
+
+def not_modified(etag):
+    '''
+    Return a 304 Not Modified response for a conditional request whose
+    If-None-Match header matched +etag+.
+    '''
+    response = HTTPNotModified()
+    response.etag = etag
+    return response
+
+
+@view_config(context=workers.QueueFull)
+def queue_full_view(exc, request):
+    return ServerBusy(str(exc))
+
 
+@view_config(context=workers.TaskTimeout)
+def task_timeout_view(exc, request):
+    return TaskTimeout(str(exc))
 
-@view_config(route_name='read', renderer='json')
+
+@view_config(route_name='read', renderer='json', decorator=replicas.read_only)
 def read_view(request):
     '''
     Read an exercise from the database and return it in a base-64
-    encoded zip data stream.
+    encoded zip data stream, or as raw zip data if the client sends
+    Accept: application/zip.
 
     GET /read
         < {
@@ -35,6 +77,8 @@ def read_view(request):
             'make_derivative': bool [default: False],  # Whether to add the derived-from element to the exercise metadata
         }
         > { 'exercise': zip_data }
+          application/zip body (with Accept: application/zip)
+          HTTPNotModified (if If-None-Match matches the ETag)
           HTTPNotFound
           HTTPBadRequest (ExeciseInvalid, BadRequest)
     '''
@@ -46,36 +90,50 @@ def read_view(request):
 
     assert not params['make_derivative'], "TODO: derivatives not yet implemented"
 
-    version = params['version']
-    if version in ['testing', 'published']:
-        result = DBSession.query(CurrentVersion).get((version, params['id']))
-        if not result:
+    # The zip data is only loaded if it isn't already cached
+    with metrics.timer('db_lookup'):
+        exercise = Exercise.get_by_version_or_branch(params['id'], params['version'], load_data=False)
+    if not exercise:
+        if params['version'] in ['testing', 'published']:
             raise NotFound("Exercise %s is not on the %s branch" % (params['id'], params['version']))
-        version = result.version
+        raise NotFound("Exercise %s with version %s not found" % (params['id'], params['version']))
+    version = exercise.version
 
-    exercise = DBSession.query(Exercise).get((params['id'], version))
-    if not exercise:
-        raise NotFound("Exercise %s with version %s not found" % (params['id'], version))
+    # Versions are immutable, so the response only depends on the
+    # resolved version, seed and representation. The contents are
+    # included too, in case a version was changed by hand.
+    contents = exercise.manifest if exercise.manifest is not None else exercise.last_updated
+    etag = make_etag('read', params['id'], version, contents, params.get('random_seed'), params['make_derivative'], accepts_zip(request))
+    if etag in request.if_none_match:
+        return not_modified(etag)
 
     if params.has_key('random_seed'):
         randomSeed = int(params['random_seed'])
-
-        import StringIO, zipfile
-        from lxml import etree
-
-        # Check that this is a template and not a static exercise
-        templateDom = etree.parse(
-            zipfile.ZipFile(StringIO.StringIO(exercise.data)).open('main.xml'),
-            parser=etree.XMLParser(remove_comments=True),
-        ).getroot()
-        logicElement = templateDom.find('logic')
-        if logicElement is None:
+        # known from when the exercise was stored, if it was stored
+        # since is_template was added
+        if exercise.is_template is False:
             raise ExerciseInvalid("Static exercise cannot have a random seed")
 
-        # Generate instance from template
-        from monassis.qnxmlservice import question_from_zip
-        question = question_from_zip(exercise.data, iRandomSeed=randomSeed)
-        
+        # Versions are immutable, so an instance is fully identified
+        # by its (id, version, seed) triple
+        cacheKey = (params['id'], version, randomSeed)
+        exerciseZip = cache.instance_cache.get(cacheKey)
+        if exerciseZip is None:
+            # stored when first generated, or pre-generated on publish
+            with metrics.timer('db_lookup'):
+                instance = ExerciseInstance.get(params['id'], version, randomSeed)
+            if instance is not None:
+                instance.touch()
+                exerciseZip = instance.data
+                cache.instance_cache.put(cacheKey, exerciseZip)
+        if exerciseZip is None:
+            try:
+                exerciseZip, generationTime = workers.pool.submit(workers.timed, generate_instance_zip, exercise.get_data(), randomSeed, exercise.is_template)
+            except NotATemplate, error:
+                raise ExerciseInvalid(str(error))
+            ExerciseInstance.store(params['id'], version, randomSeed, exerciseZip, generationTime)
+            cache.instance_cache.put(cacheKey, exerciseZip)
+
         if params['make_derivative']:
             '''
             <derived_from>
@@ -86,19 +144,8 @@ def read_view(request):
             </derived_from>
             '''
             pass # TODO
-
-        # Zip instance up again
-        import zipfile, StringIO
-        zipBytes = StringIO.StringIO()
-        zipArchive = zipfile.ZipFile(zipBytes, 'w', compression=zipfile.ZIP_DEFLATED)
-        zipArchive.writestr('main.xml', question.as_xml())
-        for filename, data in question.files.iteritems():
-            zipArchive.writestr(filename, data)
-        zipArchive.close()
-        zipBytes.seek(0)
-        exerciseZip = zipBytes.read()
     else:
-        exerciseZip = exercise.data
+        exerciseZip = exercise.get_data()
         if params['make_derivative']:
             '''
             <derived_from>
@@ -109,55 +156,316 @@ def read_view(request):
             '''
             pass # TODO
 
+    # The same URL returns either representation
+    request.response.vary = ('Accept',)
+    request.response.etag = etag
+    if accepts_zip(request):
+        # Send the zip as is, without base-64 encoding and JSON wrapping
+        return Response(body=exerciseZip, content_type='application/zip', vary=('Accept',), etag=etag)
+
+    from base64 import b64encode
+    with metrics.timer('base64'):
+        exerciseB64 = b64encode(exerciseZip)
+    return {"exercise": exerciseB64}
+
+
+def task_error(error):
+    """
+    Log an unexpected +error+ from a worker task and describe it as a
+    500 item error, so that it fails only its own item of a batch.
+    """
+    log.error("Batch item failed: %s" % error)
+    return item_error(500, getattr(error, 'type_name', type(error).__name__), str(error))
+
+
+@view_config(route_name='read_batch', renderer='json', decorator=replicas.read_only)
+def read_batch_view(request):
+    '''
+    Read many exercises, or instances of them, in one request. Each
+    item succeeds or fails independently.
+
+    POST /read_batch
+        < {
+            'exercises': [                               # The exercises to read [required]
+                {
+                    'id': str [required],                # The id of the exercise to read
+                    'version': str [default: published], # The version number or branch head of the exercise to read
+                    'random_seed': int, [optional]       # The random seed, if this exercise is a template and you want an instance of it
+                }, ...
+            ]
+        }
+        > { 'exercises': [ { 'exercise': zip_data } or { 'error': { 'status': int, 'code': str, 'message': str } }, ... ] }
+          HTTPBadRequest (BadRequest)
+    '''
+    params = parse_json_body(
+        request.json_body,
+        required_keys = ['exercises'])
+    if not isinstance(params['exercises'], list):
+        raise BadRequest("exercises must be a list")
+    maxItems = int(request.registry.settings.get('read_batch.max_items', 100))
+    if len(params['exercises']) > maxItems:
+        raise BadRequest("At most %d exercises can be read in one batch" % maxItems)
+
+    items = [parse_json_body(
+        item,
+        required_keys = ['id'],
+        optional_keys = ['random_seed'],
+        defaults = {'version': 'published'}) for item in params['exercises']]
+    for item in items:
+        if item.has_key('random_seed'):
+            item['random_seed'] = int(item['random_seed'])
+
+    # Resolve all branch heads and fetch all exercises in one query,
+    # without their zips, which cached instances don't need
+    with metrics.timer('db_lookup'):
+        exercises = Exercise.get_many_by_version_or_branch(
+            [(item['id'], item['version']) for item in items], load_data=False)
+
+    results = [None] * len(items)
+    reads = {}
+    tasks = {}
+    for i, item in enumerate(items):
+        exercise = exercises.get((item['id'], item['version']))
+        if exercise is None:
+            if item['version'] in ['testing', 'published']:
+                message = "Exercise %s is not on the %s branch" % (item['id'], item['version'])
+            else:
+                message = "Exercise %s with version %s not found" % (item['id'], item['version'])
+            results[i] = {'error': item_error(404, 'NotFound', message)}
+            continue
+        item['version'] = exercise.version
+        if not item.has_key('random_seed'):
+            reads[i] = exercise
+        elif exercise.is_template is False:
+            results[i] = {'error': item_error(400, 'ExerciseInvalid', "Static exercise cannot have a random seed")}
+        else:
+            cacheKey = (item['id'], item['version'], item['random_seed'])
+            results[i] = cache.instance_cache.get(cacheKey)
+            if results[i] is None:
+                tasks[cacheKey] = exercise
+
+    # Use stored instances, and generate the rest in parallel
+    generated = {}
+    for cacheKey, instance in ExerciseInstance.get_many(tasks.keys()).iteritems():
+        instance.touch()
+        generated[cacheKey] = instance.data
+        cache.instance_cache.put(cacheKey, instance.data)
+        del tasks[cacheKey]
+
+    # Only now load the zips still needed, fetching their blobs in one
+    # query
+    with metrics.timer('db_lookup'):
+        blobs = Exercise.prefetch_blobs(set(reads.values()) | set(tasks.values()))
+    for i, exercise in reads.iteritems():
+        results[i] = exercise.get_data(blobs)
+    cacheKeys = tasks.keys()
+    taskArgs = [(generate_instance_zip, tasks[key].get_data(blobs), key[2], tasks[key].is_template) for key in cacheKeys]
+    for cacheKey, (success, value) in zip(cacheKeys, workers.pool.map(workers.timed, taskArgs)):
+        if success:
+            instanceZip, generationTime = value
+            generated[cacheKey] = instanceZip
+            ExerciseInstance.store(cacheKey[0], cacheKey[1], cacheKey[2], instanceZip, generationTime)
+            cache.instance_cache.put(cacheKey, instanceZip)
+        elif isinstance(value, NotATemplate):
+            generated[cacheKey] = {'error': item_error(400, 'ExerciseInvalid', str(value))}
+        elif isinstance(value, workers.TaskTimeout):
+            generated[cacheKey] = {'error': item_error(504, 'TaskTimeout', str(value))}
+        else:
+            generated[cacheKey] = {'error': task_error(value)}
+
     from base64 import b64encode
-    return {"exercise": b64encode(exerciseZip)}
+    with metrics.timer('base64'):
+        for i, item in enumerate(items):
+            if results[i] is None:
+                results[i] = generated[(item['id'], item['version'], item['random_seed'])]
+            if not isinstance(results[i], dict):
+                results[i] = {'exercise': b64encode(results[i])}
 
+    log_request('read_batch', count=len(items), generated=len(tasks))
+    return {"exercises": results}
 
-@view_config(route_name='update', renderer='json')
+
+@view_config(route_name='update', renderer='json', decorator=replicas.writes)
 def update_view(request):
     '''
     Validate an exercise and update or insert it in the database. Set
     the testing branch head to point to this version of the exercise.
 
-    PUT /update
+    The zip can be sent either base-64 encoded in JSON or, to avoid
+    encoding it and buffering the request, as a raw application/zip
+    body with the id and version in the query string or in the
+    X-Exercise-Id and X-Exercise-Version headers. Zips larger than
+    update.max_bytes are rejected.
+
+    With ?async=1, the exercise is only queued for validation and
+    storing by a background job, whose progress can be followed with
+    GET /jobs/<job_id>.
+
+    PUT /update[?async=1]
         < {
             'id': str [required],                    # The id of the exercise to save or update
             'version': str [required],               # The version of the exercise to save or update
             'data_base64': base-64 encoded zip data  # Base-64 encoded data to save
         }
-        > { 'result': 'success' }
+          or application/zip body with ?id=&version=
+        > {
+            'result': 'success',
+            'validation_cached': bool,  # Whether identical data was validated before
+          }
+          or, with async, 202 Accepted {
+            'result': 'queued',
+            'job_id': int,
+          }
+          HTTPBadRequest (ExeciseInvalid, BadRequest)
+          HTTPConflict (ExerciseConflict, if the version is stored with different contents)
+          HTTPRequestEntityTooLarge (RequestTooLarge)
     '''
-    params = parse_json_body(
-        request.json_body,
-        required_keys = ['id', 'version', 'data_base64'])
-    log_request('update', id=params['id'], version=params['version'])
-
-    from base64 import b64decode
-    data = b64decode(request.json_body['data_base64'])
-
-    # Validate exercise
-    from monassis.qnxmlservice import validate_question_zip
-    result = validate_question_zip(data)
+    maxBytes = int(request.registry.settings.get('update.max_bytes', 52428800))
+    if request.content_type == 'application/zip':
+        params = {
+            'id': request.GET.get('id') or request.headers.get('X-Exercise-Id'),
+            'version': request.GET.get('version') or request.headers.get('X-Exercise-Version'),
+        }
+        if not params['id'] or not params['version']:
+            raise BadRequest("id and version are required in the query string or the X-Exercise-Id and X-Exercise-Version headers")
+        log_request('update', id=params['id'], version=params['version'])
+        data, contentHash = read_body(request, maxBytes)
+    else:
+        params = parse_json_body(
+            request.json_body,
+            required_keys = ['id', 'version', 'data_base64'])
+        log_request('update', id=params['id'], version=params['version'])
+
+        from base64 import b64decode
+        data = b64decode(request.json_body['data_base64'])
+        if len(data) > maxBytes:
+            raise RequestTooLarge("Exercise zip of %d bytes is larger than %d bytes" % (len(data), maxBytes))
+        contentHash = None
+
+    if request.GET.get('async') in ('1', 'true'):
+        jobId = Job.enqueue('validate', params['id'], params['version'], data).id
+        transaction.commit()
+        request.response.status = 202
+        return {"result": "queued", "job_id": jobId}
+
+    # Validate exercise, unless the same data has been validated before
+    result, cached = validation.validate(data, contentHash)
     if not result['validated']:
-        result['exception'] = repr(result['exception'])
+        # keep the cached result, even though nothing else is stored
+        transaction.commit()
         raise ExerciseInvalid("Exercise failed to validate", validation_result=result)
 
     # Put exercises to database
-    from utils import now_utc
-    exercise = DBSession.merge(Exercise(id=params['id'], version=params['version'], data=data, last_updated=now_utc()))
+    try:
+        exercise = Exercise.store(params['id'], params['version'], data)
+    except VersionConflict, error:
+        transaction.commit()
+        raise ExerciseConflict(str(error))
     log.info("Put exercise: %s" % exercise)
-    currentVersion = DBSession.merge(CurrentVersion(branch='testing', id=params['id'], version=params['version']))
+    currentVersion = CurrentVersion.set_head('testing', params['id'], params['version'])
     log.info("Updated branch head: %s" % currentVersion)
     transaction.commit()
 
-    return {"result": "success"}
+    return {"result": "success", "validation_cached": cached}
+
+
+@view_config(route_name='update_batch', renderer='json', decorator=replicas.writes)
+def update_batch_view(request):
+    '''
+    Validate many exercises concurrently and update or insert all
+    those that pass in a single transaction, setting their testing
+    branch heads. Each item succeeds or fails independently.
+
+    The exercises can be sent either as JSON or, to avoid base-64
+    encoding them, as multipart/form-data with repeated id, version
+    and data (zip file) fields, matched up in order. Zips larger than
+    update.max_bytes fail with a 413 RequestTooLarge error.
+
+    PUT /update_batch
+        < {
+            'exercises': [                               # The exercises to save or update [required]
+                {
+                    'id': str [required],                # The id of the exercise to save or update
+                    'version': str [required],           # The version of the exercise to save or update
+                    'data_base64': base-64 encoded zip data [required]  # Base-64 encoded data to save
+                }, ...
+            ]
+        }
+        > { 'exercises': [
+                { 'id': str, 'version': str, 'result': 'success', 'validation_cached': bool }
+                or { 'id': str, 'version': str, 'error': { 'status': int, 'code': str, 'message': str, 'validation_result': dict } },
+                ...
+          ] }
+          HTTPBadRequest (BadRequest)
+    '''
+    if request.content_type == 'multipart/form-data':
+        ids = request.POST.getall('id')
+        versions = request.POST.getall('version')
+        files = request.POST.getall('data')
+        if not (len(ids) == len(versions) == len(files)):
+            raise BadRequest("Every exercise needs an id, version and data field")
+        try:
+            entries = [(id, version, upload.file.read()) for id, version, upload in zip(ids, versions, files)]
+        except AttributeError:
+            raise BadRequest("data fields must be file uploads")
+    else:
+        params = parse_json_body(
+            request.json_body,
+            required_keys = ['exercises'])
+        if not isinstance(params['exercises'], list):
+            raise BadRequest("exercises must be a list")
+        from base64 import b64decode
+        entries = []
+        for item in params['exercises']:
+            item = parse_json_body(item, required_keys = ['id', 'version', 'data_base64'])
+            entries.append((item['id'], item['version'], b64decode(item['data_base64'])))
+
+    maxItems = int(request.registry.settings.get('update_batch.max_items', 100))
+    if len(entries) > maxItems:
+        raise BadRequest("At most %d exercises can be updated in one batch" % maxItems)
+    log_request('update_batch', exercises=[[id, version] for id, version, data in entries])
+
+    maxBytes = int(request.registry.settings.get('update.max_bytes', 52428800))
+    validated = iter(validation.validate_many([data for id, version, data in entries if len(data) <= maxBytes]))
+
+    results = []
+    passed = []
+    for id, version, data in entries:
+        if len(data) > maxBytes:
+            results.append({'id': id, 'version': version, 'error': item_error(413, 'RequestTooLarge', "Exercise zip of %d bytes is larger than %d bytes" % (len(data), maxBytes))})
+            continue
+        result, cached = next(validated)
+        if isinstance(result, workers.TaskTimeout):
+            results.append({'id': id, 'version': version, 'error': item_error(504, 'TaskTimeout', str(result))})
+        elif isinstance(result, Exception):
+            results.append({'id': id, 'version': version, 'error': task_error(result)})
+        elif not result['validated']:
+            results.append({'id': id, 'version': version, 'error': item_error(400, 'ExerciseInvalid', "Exercise failed to validate", validation_result=result)})
+        else:
+            results.append({'id': id, 'version': version, 'result': 'success', 'validation_cached': cached})
+            passed.append((id, version, data))
+
+    # Put all valid exercises to the database at once
+    storedResults = [result for result in results if 'error' not in result]
+    for result, exercise in zip(storedResults, Exercise.store_many(passed)):
+        if isinstance(exercise, VersionConflict):
+            del result['result'], result['validation_cached']
+            result['error'] = item_error(409, 'ExerciseConflict', str(exercise))
+            continue
+        log.info("Put exercise: %s" % exercise)
+        currentVersion = CurrentVersion.set_head('testing', result['id'], result['version'])
+        log.info("Updated branch head: %s" % currentVersion)
+    transaction.commit()
+
+    return {"exercises": results}
 
 
-@view_config(route_name='publish', renderer='json')
+@view_config(route_name='publish', renderer='json', decorator=replicas.writes)
 def publish_view(request):
     '''
     Set the published branch head to point to a given version of an
-    exercise.
+    exercise. Publishing queues a job to pre-generate the instances
+    for the warmup.seeds of a template.
 
     PUT /publish
         < {
@@ -176,25 +484,23 @@ def publish_view(request):
 
     log_request('Publish entry', entry=params.get('id'))
 
-    version = params['version']
-    if version in ['testing', 'published']:
-        result = DBSession.query(CurrentVersion).get((version, params['id']))
-        if not result:
-            raise NotFound("Exercise %s is not on the %s branch" % (params['id'], params['version']))
-        version = result.version
-
-    entry = Exercise.get_by_id(params['id'], version)
+    entry = Exercise.get_by_version_or_branch(params['id'], params['version'], load_data=False)
     if not entry:
-        raise NotFound("Exercise with id %s and version %s not found" % (str(params['id']), str(version)))
+        if params['version'] in ['testing', 'published']:
+            raise NotFound("Exercise %s is not on the %s branch" % (params['id'], params['version']))
+        raise NotFound("Exercise with id %s and version %s not found" % (str(params['id']), str(params['version'])))
+    version = entry.version
 
-    currentVersion = DBSession.merge(CurrentVersion(branch=params['branch'], id=params['id'], version=version))
+    currentVersion = CurrentVersion.set_head(params['branch'], params['id'], version)
     log.info("Updated branch head: %s" % currentVersion)
+    if params['branch'] == 'published' and warmup.seeds:
+        Job.enqueue('warmup', params['id'], version)
     transaction.commit()
 
     return {"result": "success"}
 
 
-@view_config(route_name='retract', renderer='json')
+@view_config(route_name='retract', renderer='json', decorator=replicas.writes)
 def retract_view(request):
     '''
     Remove an exercise from the published branch or both testing and
@@ -222,32 +528,277 @@ def retract_view(request):
     log_request('Retract entry', entry=params.get('id'))
 
     for branch in branches:
-        currentVersion = CurrentVersion.get_by_id(branch, params['id'])
+        currentVersion = CurrentVersion.retract(branch, params['id'])
         if currentVersion:
-            DBSession.delete(currentVersion)
             log.info("Retracted branch head: %s" % currentVersion)
 
     return {"result": "success"}
 
 
-@view_config(route_name='list', renderer='json')
+@view_config(route_name='list', renderer='json', decorator=replicas.read_only)
 def list_view(request):
     '''
-    Return a list of all exercise ids available on the given branch.
+    Return a list of all exercise ids available on the given branch,
+    in id order. Large branches can be listed a page at a time by
+    passing the returned next id as after, or streamed as
+    newline-delimited JSON if the client sends
+    Accept: application/x-ndjson.
 
     GET /list
         < {
             'branch': ('testing', 'published'), [default: published]  # The branch to list
+            'limit': int, [optional]                                   # The maximum number of exercises to return
+            'after': str, [optional]                                   # Only list exercises with ids after this one
+            'type': ('template', 'static'), [optional]                 # Only list templates or static exercises
         }
-        > { 'exercises': [ { 'id': str, 'version': str }, ... ] }
+        > {
+            'exercises': [ { 'id': str, 'version': str }, ... ],
+            'cursor': int,  # The /changes cursor as of this listing
+            'next': str,    # The after id for the next page, if limit was given and there are more exercises
+          }
+          application/x-ndjson body of { 'id': str, 'version': str } lines (with Accept: application/x-ndjson)
+          HTTPNotModified (if If-None-Match matches the ETag)
     '''
     params = parse_json_body(
         request.json_body,
+        optional_keys = ['limit', 'after', 'type'],
         defaults = {'branch': 'published'})
 
     if params['branch'] not in ['testing', 'published']:
         raise HTTPBadRequest("Unknown branch %s should be 'testing' or 'published'" % (repr(params['branch'])))
+    template = None
+    if params.get('type') is not None:
+        if params['type'] not in ['template', 'static']:
+            raise BadRequest("Unknown type %s should be 'template' or 'static'" % (repr(params['type'])))
+        template = params['type'] == 'template'
+    limit = params.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        if limit < 1:
+            raise BadRequest("limit must be at least 1")
+    stream = request.accept.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+    # The listing only changes when the branch revision does
+    etag = make_etag('list', BranchRevision.get_revision(params['branch']), sorted(params.items()), stream)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+
+    if stream:
+        return Response(
+            app_iter=stream_list(params['branch'], params.get('after'), limit, replicas.current_replica(), template=template),
+            content_type='application/x-ndjson', etag=etag, vary=('Accept',))
+
+    request.response.etag = etag
+    request.response.vary = ('Accept',)
+    # The cursor is read first, so that changes committed in between
+    # are in the listing and also followed from the cursor, rather
+    # than missing from both
+    result = {"cursor": BranchChange.get_cursor(params['branch'])}
+    rows = CurrentVersion.query_branch(
+        params['branch'], params.get('after'), limit + 1 if limit is not None else None, template=template).all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        result['next'] = rows[-1].id
+    result['exercises'] = [{'id': row.id, 'version': row.version} for row in rows]
+    return result
+
+
+def stream_list(branch, after, limit, replica=None, chunkSize=1000, template=None):
+    '''
+    Generate the heads on +branch+ as newline-delimited JSON, reading
+    +chunkSize+ rows at a time so that memory use does not grow with
+    the size of the branch. Read from the +replica+ engine if given,
+    since the request's replica is no longer set while streaming.
+    '''
+    session = StreamSession(bind=replica) if replica is not None else StreamSession()
+    try:
+        lines = []
+        for row in CurrentVersion.query_branch(branch, after, limit, session=session, template=template).yield_per(chunkSize):
+            lines.append(json.dumps({'id': row.id, 'version': row.version}) + '\n')
+            if len(lines) == chunkSize:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+    finally:
+        session.close()
+
+
+@view_config(route_name='changes', renderer='json', decorator=replicas.read_only)
+def changes_view(request):
+    '''
+    Return the changes to the heads of a branch since a cursor, oldest
+    first. Pass the returned cursor as since in the next call to
+    follow the branch.
+
+    GET /changes?branch=&since=&limit=
+        < branch: ('testing', 'published') [default: published]  # The branch to follow
+          since: int [default: 0]                                # Only return changes after this cursor
+          limit: int [default: 1000]                             # The maximum number of changes to return
+        > {
+            'changes': [ { 'seq': int, 'id': str, 'version': str or None, 'change': ('added', 'moved', 'retracted') }, ... ],
+            'cursor': int,
+          }
+    '''
+    branch = request.GET.get('branch', 'published')
+    if branch not in ['testing', 'published']:
+        raise BadRequest("Unknown branch %s should be 'testing' or 'published'" % (repr(branch)))
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = min(int(request.GET.get('limit', 1000)), 10000)
+    except ValueError:
+        raise BadRequest("since and limit must be integers")
+    if limit < 1:
+        raise BadRequest("limit must be at least 1")
+
+    changes = BranchChange.get_since(branch, since, limit)
+    cursor = changes[-1].seq if changes else since
+    return {"changes": changes, "cursor": cursor}
+
+
+@view_config(route_name='job', renderer='json')
+def job_view(request):
+    '''
+    Return the status of a background job, e.g. one queued by an
+    asynchronous /update. Finished jobs have a result; for validation
+    jobs it is { 'validated': bool, 'validation_cached': bool } plus
+    the 'validation_result' if the exercise failed to validate.
+
+    GET /jobs/<job_id>
+        > {
+            'job': {
+                'id': int,
+                'kind': 'validate',
+                'status': ('queued', 'running', 'succeeded', 'failed'),
+                'exercise_id': str,
+                'version': str,
+                'created': ISO 8601 datetime,
+                'started': ISO 8601 datetime or None,
+                'finished': ISO 8601 datetime or None,
+                'result': dict or None,
+                'queue_position': int,  # Only while queued
+            }
+          }
+          HTTPNotFound
+    '''
+    job = Job.get_by_id(int(request.matchdict['job_id']))
+    if job is None:
+        raise NotFound("Job %s not found" % request.matchdict['job_id'])
+    return {"job": job}
+
 
-    query = DBSession.query(CurrentVersion).filter(CurrentVersion.branch == params['branch'])
-    exercises = [{'id': row.id, 'version': row.version} for row in query]
-    return {"exercises": exercises}
+@view_config(route_name='metrics')
+def metrics_view(request):
+    '''
+    Return request and phase metrics, summed over all server and worker
+    processes that write to metrics.dir, in the Prometheus text format.
+
+    GET /metrics
+        > text/plain Prometheus exposition format
+    '''
+    return Response(
+        body=metrics.collect().render(),
+        headerlist=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+
+
+@view_config(route_name='profiles', renderer='json')
+def profiles_view(request):
+    '''
+    List the stored request profiles, newest first. Only available
+    with profiling.enabled.
+
+    GET /admin/profiles
+        > {
+            'profiles': [ {
+                'request_id': str,
+                'method': str,
+                'path': str,
+                'route': str or None,
+                'status': int,
+                'duration': float,  # Seconds
+                'created': ISO 8601 datetime,
+            }, ... ]
+          }
+          HTTPNotFound
+    '''
+    if not profiling.enabled:
+        raise NotFound("Profiling is not enabled")
+    return {"profiles": profiling.list_profiles()}
+
+
+@view_config(route_name='profile')
+def profile_view(request):
+    '''
+    Download a request profile in the pstats format, for loading with
+    pstats.Stats or a viewer such as snakeviz, or with ?format=text a
+    summary of the functions with the most cumulative time.
+
+    GET /admin/profiles/<request_id>[?format=text]
+        > application/octet-stream pstats data
+          text/plain summary (with format=text)
+          HTTPNotFound
+    '''
+    if not profiling.enabled:
+        raise NotFound("Profiling is not enabled")
+    path = profiling.profile_path(request.matchdict['request_id'], 'prof')
+    if not os.path.exists(path):
+        raise NotFound("Profile %s not found" % request.matchdict['request_id'])
+
+    if request.GET.get('format') == 'text':
+        import pstats
+        summary = StringIO.StringIO()
+        pstats.Stats(path, stream=summary).sort_stats('cumulative').print_stats(50)
+        return Response(body=summary.getvalue(), content_type='text/plain', charset='utf-8')
+
+    response = FileResponse(path, request=request, content_type='application/octet-stream')
+    response.content_disposition = 'attachment; filename="%s.prof"' % request.matchdict['request_id']
+    return response
+
+
+@view_config(route_name='health', renderer='json')
+def health_view(request):
+    '''
+    Check that the server can reach the database, for load balancers
+    and monitoring.
+
+    GET /health
+        > { 'status': 'ok' }
+          503 { 'status': 'error', 'message': str }
+    '''
+    try:
+        with DBSession.get_bind().connect() as connection:
+            connection.execute("SELECT 1")
+    except DBAPIError, error:
+        log.error("Health check failed: %s" % error)
+        request.response.status = 503
+        return {"status": "error", "message": str(error.orig)}
+    return {"status": "ok"}
+
+
+@view_config(route_name='pool', renderer='json')
+def pool_view(request):
+    '''
+    Return the database connection pool statistics of this server
+    process.
+
+    GET /admin/pool
+        > {
+            'pool': {
+                'class': str,           # The pool class, e.g. TimedQueuePool
+                'size': int,            # The following only for TimedQueuePool
+                'checked_in': int,
+                'checked_out': int,
+                'overflow': int,
+                'checkouts': int,
+                'timeouts': int,
+                'wait_total': float,    # Seconds spent waiting for connections
+                'wait_max': float,
+                'wait_mean': float,
+            },
+            'pid': int,
+          }
+    '''
+    return {"pool": pool_stats(DBSession.get_bind()), "pid": os.getpid()}
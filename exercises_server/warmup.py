@@ -0,0 +1,83 @@
+'''
+Stored template instances. Every generated instance is stored in the
+exercise_instances table, shared by all server processes and kept
+across restarts, from which /read serves it directly. The least
+recently read instances are evicted once the table grows past
+instances.max_bytes.
+
+Publishing a template pre-generates (warms up) the popular seeds, so
+that the first learners to read a newly published exercise don't pay
+for generating them.
+'''
+from pyramid.settings import aslist
+
+from exercises_server import workers
+from exercises_server.instances import generate_instance_zip, is_template
+from exercises_server.models import ExerciseInstance
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# The seeds to generate when an exercise is published
+seeds = []
+
+# The maximum total size of stored instances, 0 for no limit
+max_bytes = 0
+
+
+def warm_exercise(exercise, warmSeeds=None):
+    '''
+    Generate and store the instances of +exercise+ for +warmSeeds+
+    (default: the configured seeds) that are not stored yet, in
+    parallel in the worker pool. Static exercises are skipped.
+
+    Returns the number of instances stored.
+    '''
+    if warmSeeds is None:
+        warmSeeds = seeds
+    stored = ExerciseInstance.get_seeds(exercise.id, exercise.version)
+    missing = [seed for seed in warmSeeds if seed not in stored]
+    if not missing:
+        return 0
+
+    if exercise.is_template is False:
+        return 0
+    data = exercise.get_data()
+    if exercise.is_template is None and not is_template(data):
+        return 0
+
+    count = 0
+    results = workers.pool.map(workers.timed, [(generate_instance_zip, data, seed, True) for seed in missing])
+    for seed, (success, value) in zip(missing, results):
+        if success:
+            instanceZip, generationTime = value
+            if ExerciseInstance.store(exercise.id, exercise.version, seed, instanceZip, generationTime):
+                count += 1
+        else:
+            log.warning("Failed to generate instance %s of %s: %r" % (seed, exercise, value))
+    log.info("Stored %d instances of %s" % (count, exercise))
+    return count
+
+
+def evict_instances():
+    '''
+    Evict the least recently read instances if the stored instances
+    take up more than max_bytes. Returns the number evicted.
+    '''
+    if not max_bytes:
+        return 0
+    return ExerciseInstance.evict(max_bytes)
+
+
+def setup_warmup(settings):
+    '''
+    Configure the seeds to generate on publish from the warmup.seeds
+    setting, a whitespace-separated list of integers, and the limit
+    on stored instances from instances.max_bytes.
+    '''
+    global seeds, max_bytes
+    seeds = [int(seed) for seed in aslist(settings.get('warmup.seeds', ''))]
+    max_bytes = int(settings.get('instances.max_bytes', 0))
+    log.info("warmup.seeds: %s, instances.max_bytes: %d" % (seeds, max_bytes))
+    return seeds
@@ -0,0 +1,328 @@
+'''
+Process pool for CPU-bound work (template instance generation and
+exercise validation), so that it does not run on, and block, the
+threads serving requests.
+
+Tasks must be picklable module-level functions taking picklable
+arguments, e.g. the functions in exercises_server.instances.
+'''
+import atexit
+import cPickle
+import cProfile
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from exercises_server import slowlog
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    '''
+    Raised when a task is submitted while the pool already has the
+    maximum number of tasks queued or running.
+    '''
+    pass
+
+
+class TaskTimeout(Exception):
+    '''
+    Raised when a task does not complete within the pool timeout.
+    '''
+    pass
+
+
+class TaskError(Exception):
+    '''
+    Raised in place of an exception raised by a task that could not
+    be sent back from the worker process, such as lxml's
+    XMLSyntaxError. The type_name attribute is the name of its class.
+    '''
+
+    def __init__(self, type_name, message):
+        # the args must match __init__ for the error to be picklable
+        Exception.__init__(self, type_name, message)
+        self.type_name = type_name
+        self.message = message
+
+
+    def __str__(self):
+        return '%s: %s' % (self.type_name, self.message)
+
+
+def _portable_error(error):
+    '''
+    Return +error+ if it survives pickling, as it must to be returned
+    from a pool process, or else a TaskError describing it.
+    '''
+    try:
+        cPickle.loads(cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL))
+        return error
+    except Exception:
+        return TaskError(type(error).__name__, str(error))
+
+
+def _call(func, args):
+    '''
+    Run +func+ in a pool process, returning exceptions instead of
+    raising them so that the completion callback always fires. An
+    exception that can't be pickled would kill the pool's result
+    handler, so it is returned as a TaskError instead.
+    '''
+    try:
+        return (True, func(*args))
+    except Exception, error:
+        return (False, _portable_error(error))
+
+
+def _call_profiled(func, args):
+    '''
+    Like _call, but run under cProfile, adding the stats dict to the
+    returned tuple.
+    '''
+    profile = cProfile.Profile()
+    outcome = profile.runcall(_call, func, args)
+    profile.create_stats()
+    return outcome + (profile.stats,)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def profiled():
+    '''
+    Profile the tasks submitted by this thread within the with block
+    in their worker processes, under the usual pool limits. Yields a
+    list to which the pstats-format stats dict of each task is added
+    as its result is collected.
+    '''
+    previous = getattr(_local, 'profiles', None)
+    _local.profiles = []
+    try:
+        yield _local.profiles
+    finally:
+        _local.profiles = previous
+
+
+def _profiles():
+    return getattr(_local, 'profiles', None)
+
+
+@contextmanager
+def background(timeout=None):
+    '''
+    Within the with block, tasks submitted by this thread wait for the
+    queue to have room instead of raising QueueFull, and wait up to
+    +timeout+ seconds (None: indefinitely) for their results instead
+    of the pool timeout. For background jobs, which no client is
+    waiting on.
+    '''
+    previous = getattr(_local, 'background', None)
+    _local.background = (timeout,)
+    try:
+        yield
+    finally:
+        _local.background = previous
+
+
+def _background():
+    '''
+    Return a (timeout,) tuple if this thread is running in the
+    background, or None.
+    '''
+    return getattr(_local, 'background', None)
+
+
+def timed(func, *args):
+    '''
+    Return the pair (func(*args), seconds taken). Submit this with
+    the function to time as its first argument to measure how long a
+    task ran in its worker, excluding the time it was queued.
+    '''
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+class WorkerPool(object):
+    '''
+    A bounded pool of worker processes.
+
+    processes - Number of worker processes. If 0, tasks are run inline
+        in the calling thread and the other limits do not apply.
+
+    timeout - Seconds to wait for a task to complete before giving up
+        with TaskTimeout. The task itself keeps its worker until it
+        finishes. None to wait indefinitely.
+
+    max_queue - Maximum number of tasks queued or running at once,
+        beyond which submit raises QueueFull. 0 for no limit.
+
+    max_tasks_per_child - Number of tasks after which a worker process
+        is replaced by a fresh one, to contain memory growth. None to
+        never recycle workers.
+    '''
+
+    def __init__(self, processes=0, timeout=None, max_queue=0, max_tasks_per_child=None):
+        self.processes = processes
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.max_tasks_per_child = max_tasks_per_child
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._pool = None
+        self._pid = None
+
+
+    def _get_pool(self):
+        # Pools can't be shared across a fork, so create one lazily
+        # in each (gunicorn worker) process
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                log.info("Starting %d worker processes" % self.processes)
+                self._pool = multiprocessing.Pool(
+                    self.processes, maxtasksperchild=self.max_tasks_per_child)
+                self._pid = os.getpid()
+            return self._pool
+
+
+    def _reserve(self):
+        with self._lock:
+            if _background() is not None:
+                while self.max_queue and self.pending >= self.max_queue:
+                    self._released.wait()
+            elif self.max_queue and self.pending >= self.max_queue:
+                raise QueueFull("Server is busy, %d tasks already queued" % self.pending)
+            self.pending += 1
+
+
+    def _release(self, result=None):
+        with self._lock:
+            self.pending -= 1
+            self._released.notify()
+
+
+    def apply_async(self, func, *args):
+        '''
+        Submit +func(*args)+ to the pool. Returns a handle to pass to
+        result().
+        '''
+        # The handle is a pair of the pool's AsyncResult, or None if
+        # the task was run inline, and the inline (success, value)
+        if not self.processes:
+            return (None, _call(func, args))
+
+        call = _call_profiled if _profiles() is not None else _call
+        self._reserve()
+        try:
+            return (self._get_pool().apply_async(call, (func, args), callback=self._release), None)
+        except:
+            self._release()
+            raise
+
+
+    def result(self, handle):
+        '''
+        Wait for and return the result of a task submitted with
+        apply_async, re-raising any exception it raised.
+        '''
+        asyncResult, outcome = handle
+        if asyncResult is not None:
+            background = _background()
+            timeout = background[0] if background is not None else self.timeout
+            start = time.time()
+            try:
+                outcome = asyncResult.get(timeout)
+            except multiprocessing.TimeoutError:
+                raise TaskTimeout("Task did not complete within %s seconds" % timeout)
+            finally:
+                slowlog.record_phase('worker_pool', time.time() - start)
+            if len(outcome) == 3:
+                success, value, stats = outcome
+                if _profiles() is not None:
+                    _profiles().append(stats)
+                outcome = (success, value)
+
+        success, value = outcome
+        if not success:
+            raise value
+        return value
+
+
+    def submit(self, func, *args):
+        '''
+        Run +func(*args)+ in the pool and return its result.
+        '''
+        return self.result(self.apply_async(func, *args))
+
+
+    def map(self, func, argsList):
+        '''
+        Run +func(*args)+ in the pool for each tuple in +argsList+,
+        keeping as many tasks in flight as the queue limit allows.
+
+        Returns a list of (success, value) pairs in the same order,
+        where value is the result or the exception raised (including
+        TaskTimeout). Raises QueueFull only if not even one task could
+        be queued.
+        '''
+        handles = []
+        results = []
+        for args in argsList:
+            while True:
+                try:
+                    handles.append(self.apply_async(func, *args))
+                    break
+                except QueueFull:
+                    if len(results) == len(handles):
+                        raise
+                    results.append(self._collect(handles[len(results)]))
+        while len(results) < len(handles):
+            results.append(self._collect(handles[len(results)]))
+        return results
+
+
+    def _collect(self, handle):
+        try:
+            return (True, self.result(handle))
+        except Exception, error:
+            return (False, error)
+
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+            self._pool = None
+
+
+pool = WorkerPool()
+
+
+def setup_worker_pool(settings):
+    '''
+    (Re)configure the module-level worker pool from the workers.*
+    settings.
+    '''
+    global pool
+    pool.close()
+
+    timeout = settings.get('workers.timeout')
+    maxTasksPerChild = settings.get('workers.max_tasks_per_child')
+    pool = WorkerPool(
+        processes=int(settings.get('workers.processes', 0)),
+        timeout=float(timeout) if timeout else None,
+        max_queue=int(settings.get('workers.max_queue', 0)),
+        max_tasks_per_child=int(maxTasksPerChild) if maxTasksPerChild else None)
+    return pool
+
+
+@atexit.register
+def _shutdown():
+    pool.close()
@@ -0,0 +1,175 @@
+'''
+Member-level access to exercise zips.
+
+Members are read and written in their compressed form, so that
+unchanged members can be copied from one zip into another without
+being decompressed and compressed again.
+'''
+import StringIO
+import struct
+import zipfile
+import zlib
+from hashlib import sha1
+
+
+# Fixed member timestamp, so that rebuilding a zip from the same
+# members always gives the same bytes
+MEMBER_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Members in these formats are compressed already, so they are stored
+# rather than deflated again
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.zip', '.gz', '.mp3', '.mp4', '.ogg')
+
+
+class ZipMember(object):
+    '''
+    A zip member in compressed form.
+
+    name - The file name within the zip.
+
+    content_hash - The SHA-1 hex digest of the uncompressed contents.
+
+    size - The uncompressed size in bytes.
+
+    crc - The CRC-32 of the uncompressed contents.
+
+    compress_type - zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED.
+
+    raw - The compressed contents.
+    '''
+
+    def __init__(self, name, content_hash, size, crc, compress_type, raw):
+        self.name = name
+        self.content_hash = content_hash
+        self.size = size
+        self.crc = crc
+        self.compress_type = compress_type
+        self.raw = raw
+
+
+    def __repr__(self):
+        return "<ZipMember name=%s, content_hash=%s, size=%s>" % (self.name, self.content_hash, self.size)
+
+
+    def contents(self):
+        '''
+        Return the uncompressed contents.
+        '''
+        if self.compress_type == zipfile.ZIP_STORED:
+            return self.raw
+        return zlib.decompress(self.raw, -15)
+
+
+def read_raw(zipArchive, info):
+    '''
+    Return the compressed contents of the member +info+ of the open
+    ZipFile +zipArchive+.
+    '''
+    fp = zipArchive.fp
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    return fp.read(info.compress_size)
+
+
+def read_members(data):
+    '''
+    Return the file members of the zip +data+ as a list of ZipMember
+    instances, in zip order. Directory entries are skipped.
+    '''
+    zipArchive = zipfile.ZipFile(StringIO.StringIO(data))
+    members = []
+    for info in zipArchive.infolist():
+        if info.filename.endswith('/'):
+            continue
+        contents = zipArchive.read(info)
+        members.append(ZipMember(
+            name=info.filename,
+            content_hash=sha1(contents).hexdigest(),
+            size=info.file_size,
+            crc=info.CRC,
+            compress_type=info.compress_type,
+            raw=read_raw(zipArchive, info)))
+    return members
+
+
+class ZipWriter(zipfile.ZipFile):
+    '''
+    A ZipFile that can also write members that are already compressed.
+    '''
+
+    def writemember(self, name, data):
+        '''
+        Compress and write the member +name+ with contents +data+,
+        unless it is in one of the STORED_EXTENSIONS formats.
+        '''
+        zinfo = zipfile.ZipInfo(filename=name, date_time=MEMBER_DATE_TIME)
+        zinfo.external_attr = 0o600 << 16
+        if name.lower().endswith(STORED_EXTENSIONS):
+            zinfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+        self.writestr(zinfo, data)
+
+
+    def writeraw(self, member):
+        '''
+        Write the ZipMember +member+ without recompressing it.
+        '''
+        zinfo = zipfile.ZipInfo(filename=member.name, date_time=MEMBER_DATE_TIME)
+        zinfo.external_attr = 0o600 << 16
+        zinfo.compress_type = member.compress_type
+        zinfo.file_size = member.size
+        zinfo.compress_size = len(member.raw)
+        zinfo.CRC = member.crc
+        zinfo.header_offset = self.fp.tell()
+        self._writecheck(zinfo)
+        self._didModify = True
+        self.fp.write(zinfo.FileHeader())
+        self.fp.write(member.raw)
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+
+
+def build_zip(members):
+    '''
+    Return the zip data made up of the ZipMember instances +members+,
+    in order.
+    '''
+    zipBytes = StringIO.StringIO()
+    zipArchive = ZipWriter(zipBytes, 'w')
+    for member in members:
+        zipArchive.writeraw(member)
+    zipArchive.close()
+    return zipBytes.getvalue()
+
+
+def build_instance_zip(templateData, mainXml, files):
+    '''
+    Return the zip data of an exercise instance with main.xml contents
+    +mainXml+ and the other members in the dict +files+, generated
+    from the template zip +templateData+. Members with the same name,
+    size and CRC as a template member are copied from the template in
+    their compressed form; the others are compressed unless they are
+    compressed already.
+    '''
+    template = zipfile.ZipFile(StringIO.StringIO(templateData))
+    templateInfos = dict((info.filename, info) for info in template.infolist())
+
+    zipBytes = StringIO.StringIO()
+    zipArchive = ZipWriter(zipBytes, 'w')
+    zipArchive.writemember('main.xml', mainXml)
+    for name, data in files.iteritems():
+        info = templateInfos.get(name)
+        if info is not None and info.file_size == len(data) and info.CRC == zlib.crc32(data) & 0xffffffff:
+            zipArchive.writeraw(ZipMember(
+                name=name,
+                content_hash=None,
+                size=info.file_size,
+                crc=info.CRC,
+                compress_type=info.compress_type,
+                raw=read_raw(template, info)))
+        else:
+            zipArchive.writemember(name, data)
+    zipArchive.close()
+    return zipBytes.getvalue()
@@ -8,7 +8,7 @@ README = open(os.path.join(here, 'README.rst')).read()
 requires = [
     'pyramid >= 1.4',
     'python-dateutil >= 2.1',
-    'SQLAlchemy',
+    'SQLAlchemy >= 1.2, < 1.4',
     'transaction',
     'pyramid_tm',
     'pyramid_debugtoolbar',
@@ -45,5 +45,10 @@ setup(name='exercises_server',
       main = exercises_server:main
       [console_scripts]
       initialize_db = exercises_server.scripts.initializedb:main
+      deduplicate_exercises = exercises_server.scripts.deduplicate:main
+      warmup_instances = exercises_server.scripts.warmup:main
+      purge_instances = exercises_server.scripts.purge:main
+      benchmark_exercises = exercises_server.scripts.benchmark:main
+      introspect_exercises = exercises_server.scripts.introspect:main
       """,
       )